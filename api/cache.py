@@ -0,0 +1,351 @@
+# api/cache.py
+
+import os
+import json
+import math
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.encoders import jsonable_encoder
+
+# Response cache settings
+API_CACHE_ENABLED = os.getenv("API_CACHE_ENABLED", "true").lower() == "true"
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", "300")) # Seconds a cached response stays fresh
+API_CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "1024"))
+# How often (seconds) to check the pipeline-run marker; a new run invalidates every cached response
+API_CACHE_MARKER_POLL_SECONDS = float(os.getenv("API_CACHE_MARKER_POLL_SECONDS", "30"))
+# Where cached responses live: "memory" (per process) or "redis" (shared by all uvicorn workers)
+API_CACHE_BACKEND = os.getenv("API_CACHE_BACKEND", "memory").lower()
+API_CACHE_REDIS_URL = os.getenv("API_CACHE_REDIS_URL", "redis://localhost:6379/0")
+API_CACHE_KEY_PREFIX = os.getenv("API_CACHE_KEY_PREFIX", "medical_api")
+# Seconds a worker waits for another worker to fill a key before computing it itself
+API_CACHE_FILL_TIMEOUT = float(os.getenv("API_CACHE_FILL_TIMEOUT", "10"))
+
+def compute_etag(value) -> str:
+    """Strong ETag over the JSON form of a response body."""
+    body = json.dumps(jsonable_encoder(value), sort_keys=True, separators=(',', ':'))
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+def http_date(moment: datetime) -> str:
+    """Formats a datetime for Last-Modified; naive datetimes are taken as UTC."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+def is_not_modified(request_headers, etag: str, last_modified: str) -> bool:
+    """Evaluates If-None-Match (preferred) or If-Modified-Since against a cached response."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+class CacheEntry:
+    """A cached response body with the headers needed to serve and revalidate it."""
+
+    __slots__ = ("value", "headers", "etag", "last_modified")
+
+    def __init__(self, value, headers, etag, last_modified):
+        self.value = value
+        self.headers = headers
+        self.etag = etag
+        self.last_modified = last_modified
+
+class CacheBackend(ABC):
+    """
+    Interface of the API response cache. Subclasses implement _load, _store and _clear;
+    this class builds entries and keeps the hit/miss counters reported by metrics().
+    Backends whose operations block on I/O set `blocking`, so callers run them off the event loop.
+    try_lock/unlock/is_locked coordinate filling a key across processes; the defaults allow every fill.
+    """
+
+    name = "base"
+    blocking = False
+
+    def __init__(self, ttl=API_CACHE_TTL):
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                       "invalidations": 0, "coalesced": 0, "errors": 0}
+
+    def count(self, stat, n=1):
+        with self._stats_lock:
+            self._stats[stat] += n
+
+    def get(self, key, record=True):
+        """Returns the fresh entry for key, or None. `record=False` leaves hit/miss counters alone."""
+        entry = self._load(key)
+        if record:
+            self.count("hits" if entry is not None else "misses")
+        return entry
+
+    def set(self, key, value, headers=None, last_modified=None):
+        """Stores a response body and returns its entry."""
+        entry = CacheEntry(
+            value=value,
+            headers=dict(headers or {}),
+            etag=compute_etag(value),
+            last_modified=http_date(last_modified or datetime.now(timezone.utc)),
+        )
+        self._store(key, entry)
+        return entry
+
+    def invalidate(self):
+        """Drops every entry."""
+        self._clear()
+        self.count("invalidations")
+
+    def try_lock(self, key) -> bool:
+        """Claims the right to compute key; False means another process is already computing it."""
+        return True
+
+    def unlock(self, key):
+        pass
+
+    def is_locked(self, key) -> bool:
+        """True while some process holds the fill lock for key."""
+        return False
+
+    def entries(self):
+        """Number of cached entries, or None if the backend cannot tell cheaply."""
+        return None
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "backend": self.name,
+            "entries": self.entries(),
+            "max_entries": getattr(self, "max_entries", None),
+            "ttl_seconds": self.ttl,
+            "hit_ratio": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+            **stats,
+        }
+
+    @abstractmethod
+    def _load(self, key):
+        """Returns the fresh entry for key, or None."""
+
+    @abstractmethod
+    def _store(self, key, entry):
+        """Stores an entry under key."""
+
+    @abstractmethod
+    def _clear(self):
+        """Drops every entry."""
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Thread-safe in-process LRU cache with a per-entry TTL. Least recently used entries
+    are evicted once max_entries is reached. Each uvicorn worker has its own copy.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries=API_CACHE_MAX_ENTRIES, ttl=API_CACHE_TTL):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (entry, expires_at)
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.count("expirations")
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = (entry, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.count("evictions")
+
+    def _clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def entries(self):
+        with self._lock:
+            return len(self._entries)
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+class RedisClient:
+    """
+    Minimal blocking client for the Redis serialization protocol (RESP2), covering the few
+    commands the cache needs. Works against Redis, Valkey, KeyDB or any local stand-in that
+    speaks RESP, without an extra dependency. Each thread gets its own connection.
+    """
+
+    def __init__(self, url=API_CACHE_REDIS_URL, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock, self._local.reader = sock, sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", self.db)
+
+    def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by Redis server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self._local.reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis server: {line!r}")
+
+    def execute(self, *args):
+        """Sends one command and returns its reply, reconnecting once if the connection was lost."""
+        for attempt in range(2):
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            try:
+                return self._roundtrip(*args)
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.reader.close()
+            sock.close()
+        self._local.sock = self._local.reader = None
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Shared cache for multi-worker deployments, stored in Redis as JSON with a TTL
+    (eviction is left to the server's maxmemory policy). Callers include the pipeline-run
+    marker in every key, so a new run is picked up by all workers without deleting anything;
+    invalidate() only counts. Redis being unreachable degrades to cache misses, not errors.
+    """
+
+    name = "redis"
+    blocking = True
+
+    # Deletes a fill lock only if it still holds this process's token, in one atomic step: after
+    # the lock expired and another process took it, a plain GET then DEL could delete theirs
+    UNLOCK_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+
+    # Seconds to skip Redis after a failed command, so an outage does not add a timeout to every request
+    RETRY_AFTER_SECONDS = 5
+
+    def __init__(self, url=API_CACHE_REDIS_URL, ttl=API_CACHE_TTL, prefix=API_CACHE_KEY_PREFIX,
+                 lock_timeout=API_CACHE_FILL_TIMEOUT, client=None):
+        super().__init__(ttl)
+        self.client = client or RedisClient(url)
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self._token = uuid.uuid4().hex # Identifies this process's fill locks
+        self._retry_at = 0.0
+
+    def _key(self, kind, key):
+        return f"{self.prefix}:{kind}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def _execute(self, *args, default=None):
+        if time.monotonic() < self._retry_at:
+            return default
+        try:
+            return self.client.execute(*args)
+        except (OSError, ConnectionError) as e:
+            self._retry_at = time.monotonic() + self.RETRY_AFTER_SECONDS
+            self.count("errors")
+            print(f"Redis cache unavailable, retrying in {self.RETRY_AFTER_SECONDS}s: {e}")
+            return default
+        except RedisError as e:
+            self.count("errors")
+            print(f"Redis cache error: {e}")
+            return default
+
+    def _load(self, key):
+        payload = self._execute("GET", self._key("entry", key))
+        if payload is None:
+            return None
+        data = json.loads(payload)
+        return CacheEntry(data["value"], data["headers"], data["etag"], data["last_modified"])
+
+    def _store(self, key, entry):
+        payload = json.dumps({
+            "value": jsonable_encoder(entry.value),
+            "headers": entry.headers,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+        }, separators=(',', ':'))
+        self._execute("SET", self._key("entry", key), payload, "EX", max(1, math.ceil(self.ttl)))
+
+    def _clear(self):
+        pass
+
+    def try_lock(self, key) -> bool:
+        # If Redis is unreachable there is nothing to coordinate with, so compute locally
+        reply = self._execute("SET", self._key("lock", key), self._token, "NX", "PX",
+                              int(self.lock_timeout * 1000), default="OK")
+        return reply is not None
+
+    def unlock(self, key):
+        self._execute("EVAL", self.UNLOCK_SCRIPT, 1, self._key("lock", key), self._token)
+
+    def is_locked(self, key) -> bool:
+        return bool(self._execute("EXISTS", self._key("lock", key), default=0))
+
+def create_cache_backend(name=API_CACHE_BACKEND) -> CacheBackend:
+    """Returns the response cache backend configured by API_CACHE_BACKEND."""
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "redis":
+        return RedisCacheBackend()
+    raise ValueError(f"Unknown API_CACHE_BACKEND: {name} (expected 'memory' or 'redis')")
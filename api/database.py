@@ -1,6 +1,14 @@
 # api/database.py
 
 import os
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import psycopg2
 from dotenv import load_dotenv
 from pathlib import Path
@@ -15,6 +23,21 @@ DB_NAME = os.getenv("POSTGRES_DB")
 DB_USER = os.getenv("POSTGRES_USER")
 DB_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5")) # Seconds to wait for a free connection
+DB_POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() == "true"
+# Only connections idle for longer than this (seconds) are pinged before reuse
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+# Worker threads running blocking queries for the async endpoints (defaults to the pool size)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE)))
+# Rows fetched per round trip when streaming a large result through a server-side cursor
+DB_STREAM_CHUNK_SIZE = int(os.getenv("DB_STREAM_CHUNK_SIZE", "2000"))
+# Streams allowed at once; each holds a pooled connection until the client has read everything,
+# so this stays below the pool size to leave connections for the other endpoints
+DB_STREAM_MAX_CONCURRENT = int(os.getenv("DB_STREAM_MAX_CONCURRENT", str(max(1, DB_POOL_MAX_SIZE // 2))))
+
 def get_db_connection():
     """Establishes and returns a new database connection."""
     try:
@@ -30,6 +53,280 @@ def get_db_connection():
         print(f"Database connection failed: {e}") # Use print for simplicity in API context
         raise
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the checkout timeout."""
+
+class StreamLimitError(PoolTimeoutError):
+    """Raised when DB_STREAM_MAX_CONCURRENT streams are already open."""
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool with a checkout timeout, health checks and metrics.
+    Up to `maxconn` connections are opened on demand (`minconn` up front) and every returned
+    connection is kept for reuse; a semaphore makes callers wait up to `timeout` seconds for
+    a free one. Connections are pinged only after sitting idle for `health_check_idle` seconds;
+    a connection that breaks mid-request is discarded by connection() instead.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN_SIZE, maxconn=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, health_check=DB_POOL_HEALTH_CHECK,
+                 health_check_idle=DB_POOL_HEALTH_CHECK_IDLE):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check = health_check
+        self.health_check_idle = health_check_idle
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = [] # (connection, when it was returned), most recently returned last
+        self._closed = False
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        for _ in range(minconn):
+            self._idle.append((get_db_connection(), time.monotonic()))
+
+    def _is_healthy(self, conn, returned_at):
+        """
+        Returns True if the connection is open and, when it has been idle longer than
+        health_check_idle, still answers a trivial query. Recently used connections skip the ping.
+        """
+        if conn.closed:
+            return False
+        if not self.health_check or time.monotonic() - returned_at < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback() # Leave the connection outside of a transaction
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        """Reuses the most recently returned healthy connection, or opens a new one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._is_healthy(conn, returned_at):
+                return conn
+            self._discard(conn)
+        return get_db_connection()
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to the configured timeout."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(f"No database connection available within {self.timeout} seconds")
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._discarded += 1
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        try:
+            if not conn.closed and not close:
+                conn.rollback()
+        except Exception:
+            close = True
+        try:
+            with self._lock:
+                self._in_use -= 1
+                keep = not (close or conn.closed or self._closed)
+                if keep:
+                    self._idle.append((conn, time.monotonic()))
+            if not keep:
+                if close:
+                    self._discard(conn)
+                elif not conn.closed:
+                    conn.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection that is always returned."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        """Closes the idle connections; connections still checked out are closed when returned."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def metrics(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle), # Connections opened and waiting in the pool
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "avg_wait_ms": round(self._total_wait / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
+
+# Process-wide pool and executor, created at app startup and closed at shutdown
+_connection_pool = None
+_db_executor = None
+
+def init_pool(**kwargs):
+    """Creates the process-wide connection pool if it does not exist yet."""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = ConnectionPool(**kwargs)
+    return _connection_pool
+
+def close_pool():
+    """Closes the process-wide connection pool."""
+    global _connection_pool
+    if _connection_pool is not None:
+        _connection_pool.closeall()
+        _connection_pool = None
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it lazily if needed."""
+    return init_pool()
+
+def init_executor(max_workers=DB_EXECUTOR_WORKERS):
+    """Creates the bounded thread pool used to run blocking queries off the event loop."""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    return _db_executor
+
+def close_executor():
+    """Waits for running queries to finish and shuts the executor down."""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """
+    Runs a blocking database call in the bounded executor and awaits its result,
+    so a slow query never blocks the event loop. The executor is sized to the
+    connection pool, so queued calls wait for a thread rather than for a connection.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(init_executor(), partial(func, *args, **kwargs))
+
+class QueryStream:
+    """
+    Reads a query's result through a server-side (named) cursor, chunk_size rows per round trip,
+    so memory stays constant however many rows the query returns. open() declares the cursor and
+    fetches the first chunk, so query errors surface before a response is started. The pooled
+    connection and one of the DB_STREAM_MAX_CONCURRENT stream slots are held until close(),
+    which waits for a fetch in progress and is safe to call more than once.
+    """
+
+    _slots = threading.BoundedSemaphore(DB_STREAM_MAX_CONCURRENT)
+
+    def __init__(self, query, params=None, chunk_size=DB_STREAM_CHUNK_SIZE):
+        self.query = query
+        self.params = params
+        self.chunk_size = chunk_size
+        self.columns = []
+        self._conn = None
+        self._cursor = None
+        self._first = None
+        self._broken = False
+        self._has_slot = False
+        self._lock = threading.Lock()
+
+    def open(self):
+        # Fail fast rather than wait: a waiting stream would also tie up a DB executor thread
+        if not self._slots.acquire(blocking=False):
+            raise StreamLimitError(f"{DB_STREAM_MAX_CONCURRENT} streams already open")
+        self._has_slot = True
+        try:
+            self._conn = get_pool().getconn()
+            self._cursor = self._conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+            self._cursor.itersize = self.chunk_size
+            self._cursor.execute(self.query, self.params)
+            self._first = self._cursor.fetchmany(self.chunk_size)
+            self.columns = [column[0] for column in self._cursor.description]
+        except psycopg2.OperationalError:
+            self._broken = True
+            self.close()
+            raise
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def fetch(self):
+        """Returns the next chunk of rows (tuples in `columns` order), or [] once exhausted or closed."""
+        with self._lock:
+            if self._first is not None:
+                rows, self._first = self._first, None
+                return rows
+            if self._conn is None:
+                return []
+            try:
+                return self._cursor.fetchmany(self.chunk_size)
+            except psycopg2.OperationalError:
+                self._broken = True
+                raise
+
+    def close(self):
+        """Returns the connection to the pool (its rollback also closes the cursor) and frees the slot."""
+        with self._lock:
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                get_pool().putconn(conn, close=self._broken)
+            if self._has_slot:
+                self._has_slot = False
+                self._slots.release()
+
+async def iter_query_stream(stream):
+    """Yields the row chunks of an opened QueryStream, fetching each in the DB executor, then closes it."""
+    try:
+        while True:
+            rows = await run_in_db_executor(stream.fetch)
+            if not rows:
+                return
+            yield rows
+    finally:
+        await run_in_db_executor(stream.close)
+
 # Example use (not directly used by FastAPI, but for testing connection)
 if __name__ == "__main__":
     try:
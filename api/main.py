@@ -1,14 +1,29 @@
 # api/main.py
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from typing import List, Optional
 from datetime import date, datetime
+from decimal import Decimal
 import psycopg2.extras
-from collections import Counter
-import re
+import asyncio
+import base64
+import csv
+import io
+import json
+import time
+from functools import partial
 
-from .database import get_db_connection
-from .schemas import Message, TopProduct, ChannelActivity, Channel, ImageDetection
+from .cache import (
+    create_cache_backend, is_not_modified,
+    API_CACHE_ENABLED, API_CACHE_MARKER_POLL_SECONDS, API_CACHE_FILL_TIMEOUT
+)
+from .database import (
+    get_pool, init_pool, close_pool, init_executor, close_executor, run_in_db_executor,
+    PoolTimeoutError, StreamLimitError, QueryStream, iter_query_stream
+)
+from .schemas import Message, TopProduct, ChannelActivity, Channel, ImageDetection, PoolMetrics, CacheMetrics
 
 app = FastAPI(
     title="Telegram Medical Data Insights API",
@@ -16,142 +31,422 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# --- Connection pool lifecycle ---
+@app.on_event("startup")
+def open_connection_pool():
+    init_pool()
+    init_executor()
+
+@app.on_event("shutdown")
+def close_connection_pool():
+    close_executor()
+    close_pool()
+
 # --- Helper function to fetch data ---
 def fetch_data(query: str, params: Optional[tuple] = None):
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) # Returns rows as dictionaries
-        cur.execute(query, params)
-        return cur.fetchall()
+        with get_pool().connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur: # Returns rows as dictionaries
+                cur.execute(query, params)
+                return cur.fetchall()
+    except PoolTimeoutError as e:
+        print(f"Database pool exhausted: {e}")
+        raise HTTPException(status_code=503, detail=f"Database busy: {e}")
     except Exception as e:
         print(f"Database query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+async def fetch_data_async(query: str, params: Optional[tuple] = None):
+    """Non-blocking variant of fetch_data for use inside async endpoints."""
+    return await run_in_db_executor(fetch_data, query, params)
+
+# --- Helper functions for streaming exports (?export=ndjson|csv) ---
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FORMAT_PATTERN = "^(ndjson|csv)$"
+
+def json_default(value):
+    """Serializes the non-JSON types psycopg2 returns (dates, timestamps, numerics)."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def encode_ndjson(columns, rows) -> bytes:
+    return "".join(json.dumps(dict(zip(columns, row)), default=json_default) + "\n" for row in rows).encode()
+
+def encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+def open_query_stream(query: str, params: Optional[tuple] = None):
+    """Opens a QueryStream, mapping failures to HTTP errors the way fetch_data does."""
+    try:
+        return QueryStream(query, params).open()
+    except StreamLimitError as e:
+        print(f"Export rejected: {e}")
+        raise HTTPException(status_code=503, detail=f"Too many exports in progress: {e}")
+    except PoolTimeoutError as e:
+        print(f"Database pool exhausted: {e}")
+        raise HTTPException(status_code=503, detail=f"Database busy: {e}")
+    except Exception as e:
+        print(f"Database query failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+async def export_response(query: str, params: Optional[tuple], export: str, filename: str):
+    """
+    Streams every row of a query to the client as NDJSON or CSV, chunk by chunk from a
+    server-side cursor, instead of materializing the result and a list of models in memory.
+    """
+    stream = await run_in_db_executor(open_query_stream, query, params)
+    encode = partial(encode_ndjson, stream.columns) if export == "ndjson" else encode_csv
+
+    async def body():
+        if export == "csv":
+            yield encode_csv([stream.columns])
+        async for rows in iter_query_stream(stream):
+            yield encode(rows)
+
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[export],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export}"'},
+        background=BackgroundTask(stream.close) # Returns the connection even if the body never ran
+    )
+
+# --- Helper functions for cursor-based pagination ---
+def encode_cursor(*values) -> str:
+    """Encodes the sort key of the last row of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    Decodes a cursor produced by encode_cursor, checking it holds one value of each of `types`
+    (a type or tuple of types, as for isinstance), so malformed cursors are a 400 rather than a 500.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        values = None
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+# --- Response cache, invalidated whenever a pipeline (dbt) run finishes ---
+response_cache = create_cache_backend()
+_pipeline_marker = {"finished_at": None, "checked_at": None}
+# Headers set by endpoints that must be replayed along with a cached body
+CACHED_RESPONSE_HEADERS = ("X-Next-Cursor",)
+# Cache key -> future of the load in progress, so concurrent misses share one query (single-flight)
+_inflight_loads = {}
+# How often a worker waiting on another worker's fill checks the shared cache
+CACHE_FILL_POLL_SECONDS = 0.05
+
+def read_pipeline_marker():
+    """Returns when the last dbt run finished (recorded by its on-run-end hook), or None."""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('marts.pipeline_runs') IS NOT NULL;")
+            if not cur.fetchone()[0]:
+                return None
+            cur.execute("SELECT MAX(finished_at) FROM marts.pipeline_runs;")
+            return cur.fetchone()[0]
+
+async def refresh_pipeline_marker():
+    """Polls the pipeline-run marker at most every API_CACHE_MARKER_POLL_SECONDS; a new run clears the cache."""
+    now = time.monotonic()
+    checked_at = _pipeline_marker["checked_at"]
+    if checked_at is not None and now - checked_at < API_CACHE_MARKER_POLL_SECONDS:
+        return
+    _pipeline_marker["checked_at"] = now
+    try:
+        finished_at = await run_in_db_executor(read_pipeline_marker)
+    except Exception as e:
+        print(f"Could not read pipeline-run marker: {e}")
+        return
+    if finished_at != _pipeline_marker["finished_at"]:
+        if checked_at is not None:
+            await cache_call(response_cache.invalidate)
+        _pipeline_marker["finished_at"] = finished_at
+
+async def cache_call(func, *args, **kwargs):
+    """Calls a cache backend method, off the event loop if the backend does network I/O."""
+    if not response_cache.blocking:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+async def wait_for_fill(key):
+    """
+    Waits up to API_CACHE_FILL_TIMEOUT for another worker to store key; returns the entry or None.
+    Stops as soon as that worker's fill lock is gone: if its load failed, nothing is coming.
+    """
+    deadline = time.monotonic() + API_CACHE_FILL_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_FILL_POLL_SECONDS)
+        entry = await cache_call(response_cache.get, key, record=False)
+        if entry is not None:
+            return entry
+        if not await cache_call(response_cache.is_locked, key):
+            # A successful fill stores the entry before unlocking, so look once more
+            return await cache_call(response_cache.get, key, record=False)
+    return None
+
+async def fill_cache(key, response: Response, load):
+    """
+    Computes and stores the entry for key. The backend's fill lock makes other workers wait
+    for this result instead of running the same query; if it is held elsewhere we wait for
+    that worker's entry, and only compute ourselves when it does not show up in time.
+    """
+    locked = await cache_call(response_cache.try_lock, key)
+    if not locked:
+        entry = await wait_for_fill(key)
+        if entry is not None:
+            response_cache.count("coalesced")
+            return entry
+    try:
+        value = await load()
+        headers = {name: response.headers[name] for name in CACHED_RESPONSE_HEADERS if name in response.headers}
+        return await cache_call(response_cache.set, key, value, headers, _pipeline_marker["finished_at"])
     finally:
-        if conn:
-            conn.close()
+        if locked:
+            await cache_call(response_cache.unlock, key)
+
+async def load_once(key, response: Response, load):
+    """
+    Single-flight: the first miss for key runs fill_cache, and concurrent misses in this
+    process await its result (or its exception, e.g. a 404) instead of querying again.
+    """
+    pending = _inflight_loads.get(key)
+    if pending is not None:
+        try:
+            entry = await asyncio.shield(pending)
+            response_cache.count("coalesced")
+            return entry
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+            # The leading request was cancelled (client went away); load for ourselves
+            return await fill_cache(key, response, load)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_loads[key] = future
+    try:
+        entry = await fill_cache(key, response, load)
+        future.set_result(entry)
+        return entry
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark as retrieved when no other request was waiting
+        raise
+    finally:
+        del _inflight_loads[key]
+
+async def cached_response(request: Request, response: Response, load):
+    """
+    Returns an endpoint's result from the response cache, keyed by the pipeline-run marker,
+    path and query string, calling `load()` (the endpoint's query) once per key on a miss.
+    Sets ETag, Last-Modified and X-Cache headers, and answers If-None-Match /
+    If-Modified-Since revalidations with 304.
+    """
+    if not API_CACHE_ENABLED:
+        return await load()
+    await refresh_pipeline_marker()
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    key = f"{_pipeline_marker['finished_at']}|{request.url.path}?{query}"
+    entry = await cache_call(response_cache.get, key)
+    response.headers["X-Cache"] = "HIT" if entry else "MISS"
+    if entry is None:
+        entry = await load_once(key, response, load)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Last-Modified": entry.last_modified, "Cache-Control": "no-cache"}
+    if is_not_modified(request.headers, entry.etag, entry.last_modified):
+        return Response(status_code=304, headers={**headers, "X-Cache": response.headers["X-Cache"]})
+    for name, value in headers.items():
+        response.headers[name] = value
+    return entry.value
 
 # --- Analytical Endpoints ---
 
 # 1. GET /api/reports/top-products?limit=10
 # Returns the most frequently mentioned products/drugs.
-# This is a simplified approach; a real-world solution might use NER.
+# Mentions are extracted once per pipeline run into marts.fct_product_mentions (dbt),
+# so this is an indexed aggregate rather than a scan over every message.
 @app.get("/api/reports/top-products", response_model=List[TopProduct])
-async def get_top_products(limit: int = Query(10, ge=1, le=100)):
+async def get_top_products(request: Request, response: Response, limit: int = Query(10, ge=1, le=100)):
     """
     Returns the top N most frequently mentioned medical products or drugs across all channels.
-    This implementation uses a simple keyword frequency count.
+    Keywords are defined in scripts/medical_keywords.csv.
     """
-    # Fetch all message texts
-    messages = fetch_data("SELECT message_text FROM marts.fct_messages WHERE message_text IS NOT NULL")
-    
-    all_words = []
-    # Define a list of common medical product/drug keywords (expand as needed)
-    # This is a simplification; a robust solution would use a pre-defined dictionary or NER.
-    medical_keywords = [
-        "paracetamol", "ibuprofen", "antibiotic", "vaccine", "insulin", "syrup",
-        "tablet", "cream", "ointment", "capsule", "injection", "mask", "sanitizer",
-        "vitamin", "supplement", "drug", "medicine", "pill", "gel", "lotion",
-        "diagnostic", "equipment", "test kit", "bandage", "disinfectant", "gloves",
-        "thermometer", "blood pressure monitor", "nebulizer", "crutches", "wheelchair"
-    ]
-    
-    for msg in messages:
-        text = msg['message_text'].lower()
-        # Simple tokenization and filter for keywords
-        words = re.findall(r'\b\w+\b', text) # Extract words
-        for word in words:
-            if word in medical_keywords: # Check if word is in our predefined list
-                all_words.append(word)
-            # Also check for phrases
-            for keyword in medical_keywords:
-                if len(keyword.split()) > 1 and keyword in text:
-                    all_words.append(keyword)
-
-    if not all_words:
-        return []
-
-    word_counts = Counter(all_words)
-    top_products_data = []
-    for product, count in word_counts.most_common(limit):
-        top_products_data.append({"product_name": product, "mention_count": count})
-    
-    return top_products_data
+    return await cached_response(request, response, lambda: _load_top_products(limit))
 
-# 2. GET /api/channels/{channel_username}/activity
+async def _load_top_products(limit: int):
+    query = """
+        SELECT
+            product_name,
+            SUM(mention_count) AS mention_count
+        FROM
+            marts.fct_product_mentions
+        GROUP BY
+            product_name
+        ORDER BY
+            mention_count DESC, product_name
+        LIMIT %s;
+    """
+    results = await fetch_data_async(query, (limit,))
+    return [TopProduct(product_name=row['product_name'], mention_count=row['mention_count']) for row in results]
+
+# 2. GET /api/channels/{channel_username}/activity?start=2025-01-01&end=2025-01-31
 # Returns the posting activity for a specific channel.
+# Reads the marts.agg_channel_daily rollup (dbt), an index range scan on (channel_username, activity_date).
 @app.get("/api/channels/{channel_username}/activity", response_model=List[ChannelActivity])
-async def get_channel_activity(channel_username: str):
+async def get_channel_activity(
+    request: Request,
+    response: Response,
+    channel_username: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
     """
-    Returns the daily posting activity for a specific Telegram channel.
+    Returns the daily posting activity for a specific Telegram channel,
+    optionally limited to days between `start` and `end` (inclusive).
     """
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return await cached_response(request, response, lambda: _load_channel_activity(channel_username, start, end))
+
+async def _load_channel_activity(channel_username: str, start: Optional[date], end: Optional[date]):
     query = """
         SELECT
-            dd.full_date AS activity_date,
-            COUNT(fm.message_sk) AS message_count
+            activity_date, message_count, total_views, total_forwards, photo_count
         FROM
-            marts.fct_messages fm
-        JOIN
-            marts.dim_channels dc ON fm.channel_sk = dc.channel_sk
-        JOIN
-            marts.dim_dates dd ON fm.message_date_sk = dd.date_sk
+            marts.agg_channel_daily
         WHERE
-            dc.channel_username = %s
-        GROUP BY
-            dd.full_date
+            channel_username = %s
+            AND activity_date >= COALESCE(%s::DATE, '-infinity'::DATE)
+            AND activity_date <= COALESCE(%s::DATE, 'infinity'::DATE)
         ORDER BY
-            dd.full_date;
+            activity_date;
     """
-    results = fetch_data(query, (channel_username,))
-    if not results:
+    results = await fetch_data_async(query, (channel_username, start, end))
+    if not results and not (start or end):
         raise HTTPException(status_code=404, detail=f"No activity found for channel: {channel_username}")
-    
-    return [ChannelActivity(activity_date=row['activity_date'], message_count=row['message_count']) for row in results]
+
+    return [ChannelActivity(**row) for row in results]
 
 # 3. GET /api/search/messages?query=paracetamol
 # Searches for messages containing a specific keyword.
 @app.get("/api/search/messages", response_model=List[Message])
-async def search_messages(query: str = Query(..., min_length=2)):
+async def search_messages(
+    request: Request,
+    response: Response,
+    query: str = Query(..., min_length=2),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    export: Optional[str] = Query(None, pattern=EXPORT_FORMAT_PATTERN)
+):
     """
-    Searches for Telegram messages containing a specific keyword (case-insensitive).
+    Searches for Telegram messages matching a keyword (case-insensitive), best matches first.
+    Uses the full-text (tsvector) index for word matches and the trigram index for substrings.
+    When more results exist, the `X-Next-Cursor` response header holds the cursor for the next page.
+    With `export=ndjson` or `export=csv`, streams every match (from `cursor` on, ignoring `limit`).
     """
-    search_pattern = f"%{query.lower()}%"
-    sql_query = """
-        SELECT
-            message_sk, message_id, channel_sk, channel_username, message_date_sk, scrape_date_sk,
-            message_text, message_length, views, forwards, has_photo, photo_path,
-            is_urgent_message, is_vacancy_message, message_count
-        FROM
-            marts.fct_messages
-        WHERE
-            LOWER(message_text) LIKE %s
+    if export:
+        sql_query, params = build_search_query(query, cursor)
+        return await export_response(sql_query, tuple(params), export, "messages")
+    return await cached_response(request, response, lambda: _load_search_messages(response, query, limit, cursor))
+
+def build_search_query(query: str, cursor: Optional[str], limit: Optional[int] = None):
+    """Returns (sql, params) for the ranked message search, optionally limited to `limit` rows."""
+    # Escape LIKE wildcards so user input is matched literally
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    search_pattern = f"%{escaped}%"
+    params = [query, search_pattern]
+    cursor_filter = ""
+    if cursor:
+        last_rank, last_message_sk = decode_cursor(cursor, (int, float), str)
+        cursor_filter = "WHERE (rank, message_sk) < (%s::REAL, %s)"
+        params += [last_rank, last_message_sk]
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "LIMIT %s"
+        params.append(limit)
+
+    sql_query = f"""
+        WITH search AS (
+            SELECT websearch_to_tsquery('simple', %s) AS tsq
+        ),
+        ranked AS (
+            SELECT
+                message_sk, message_id, channel_sk, channel_username, message_date_sk, scrape_date_sk,
+                message_text, message_length, views, forwards, has_photo, photo_path,
+                is_urgent_message, is_vacancy_message, message_count,
+                ts_rank(fm.message_tsv, search.tsq) AS rank
+            FROM
+                marts.fct_messages fm, search
+            WHERE
+                fm.message_tsv @@ search.tsq
+                OR fm.message_text ILIKE %s
+        )
+        SELECT * FROM ranked
+        {cursor_filter}
         ORDER BY
-            message_date_sk DESC
-        LIMIT 100; -- Limit results for performance
+            rank DESC, message_sk DESC
+        {limit_clause};
     """
-    results = fetch_data(sql_query, (search_pattern,))
-    if not results:
+    return sql_query, params
+
+async def _load_search_messages(response: Response, query: str, limit: int, cursor: Optional[str]):
+    # Fetch one extra row to know whether another page exists
+    sql_query, params = build_search_query(query, cursor, limit + 1)
+    results = await fetch_data_async(sql_query, tuple(params))
+    if not results and not cursor:
         raise HTTPException(status_code=404, detail=f"No messages found for query: '{query}'")
-    
+
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last['rank'], last['message_sk'])
+
     # Convert RealDictRow to Message Pydantic model
     return [Message(**row) for row in results]
 
 # Endpoint to get all channels (useful for UI or discovery)
 @app.get("/api/channels", response_model=List[Channel])
-async def get_all_channels():
+async def get_all_channels(request: Request, response: Response):
     """
     Returns a list of all unique Telegram channels.
     """
+    return await cached_response(request, response, _load_all_channels)
+
+async def _load_all_channels():
     query = "SELECT channel_sk, channel_username, channel_name FROM marts.dim_channels ORDER BY channel_name;"
-    results = fetch_data(query)
+    results = await fetch_data_async(query)
     return [Channel(**row) for row in results]
 
 # Endpoint to get image detections for a message (or all detections)
 @app.get("/api/image-detections", response_model=List[ImageDetection])
-async def get_image_detections(message_sk: Optional[str] = None):
+async def get_image_detections(
+    request: Request,
+    response: Response,
+    message_sk: Optional[str] = None,
+    export: Optional[str] = Query(None, pattern=EXPORT_FORMAT_PATTERN)
+):
     """
     Returns image detection results. Can filter by message_sk.
+    With `export=ndjson` or `export=csv`, streams every matching detection instead of the first 100.
     """
+    if export:
+        sql_query, params = build_image_detections_query(message_sk)
+        return await export_response(sql_query, params, export, "image_detections")
+    return await cached_response(request, response, lambda: _load_image_detections(message_sk))
+
+def build_image_detections_query(message_sk: Optional[str]):
+    """Returns (sql, params) selecting image detections, optionally for one message."""
     sql_query = """
         SELECT
             image_detection_sk, message_sk, detected_object_class, confidence_score, image_path, detection_timestamp
@@ -162,12 +457,31 @@ async def get_image_detections(message_sk: Optional[str] = None):
     if message_sk:
         sql_query += " WHERE message_sk = %s"
         params = (message_sk,)
+    return sql_query, params
+
+async def _load_image_detections(message_sk: Optional[str]):
+    sql_query, params = build_image_detections_query(message_sk)
+    sql_query += " LIMIT 100;" # JSON responses are built in memory; use ?export= for everything
     
-    sql_query += " LIMIT 100;" # Limit results for better performance
-    
-    results = fetch_data(sql_query, params)
+    results = await fetch_data_async(sql_query, params)
     if not results and message_sk:
         raise HTTPException(status_code=404, detail=f"No image detections found for message_sk: {message_sk}")
     
     return [ImageDetection(**row) for row in results]
 
+# Endpoint to inspect the database connection pool
+@app.get("/api/metrics/db-pool", response_model=PoolMetrics)
+async def get_db_pool_metrics():
+    """
+    Returns connection pool metrics: connections in use, idle connections, checkout count and wait times.
+    """
+    return PoolMetrics(**get_pool().metrics())
+
+# Endpoint to inspect the response cache
+@app.get("/api/metrics/cache", response_model=CacheMetrics)
+async def get_cache_metrics():
+    """
+    Returns response cache metrics for this worker: entries, hits, misses, evictions, expirations,
+    invalidations, coalesced loads (requests served by another request's query) and backend errors.
+    """
+    return CacheMetrics(enabled=API_CACHE_ENABLED, **response_cache.metrics())
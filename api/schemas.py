@@ -64,6 +64,9 @@ class TopProduct(BaseModel):
 class ChannelActivity(BaseModel):
     activity_date: date
     message_count: int
+    total_views: Optional[int] = None
+    total_forwards: Optional[int] = None
+    photo_count: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -79,3 +82,31 @@ class ImageDetection(BaseModel):
 
     class Config:
         orm_mode = True
+
+# Schema for database connection pool metrics
+class PoolMetrics(BaseModel):
+    min_size: int
+    max_size: int
+    in_use: int
+    idle: int
+    checkouts: int
+    timeouts: int
+    discarded: int
+    avg_wait_ms: float
+    max_wait_ms: float
+
+# Schema for response cache metrics
+class CacheMetrics(BaseModel):
+    enabled: bool
+    backend: str
+    entries: Optional[int] = None # Not tracked by the shared (redis) backend
+    max_entries: Optional[int] = None
+    ttl_seconds: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expirations: int
+    invalidations: int
+    coalesced: int
+    errors: int
@@ -5,11 +5,15 @@ import subprocess
 from pathlib import Path
 from datetime import datetime
 
-from dagster import Definitions, job, op, ScheduleDefinition, AssetSelection, define_asset_job
+from dagster import Definitions, job, op, In, Out, Nothing, ScheduleDefinition, AssetSelection, define_asset_job
 
 # Define the base directory for scripts relative to this file
 SCRIPTS_DIR = Path(__file__).parent.parent / "scripts"
 DBT_DIR = Path(__file__).parent.parent / "medical_dbt" # Your dbt project directory
+# Months of raw table partitions created ahead of the writers on every run
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '1'))
+# Set to 'true' to rebuild incremental dbt models from scratch on the next run
+DBT_FULL_REFRESH = os.getenv('DBT_FULL_REFRESH', 'false').lower() == 'true'
 
 # --- Ops Definitions ---
 
@@ -42,7 +46,35 @@ def scrape_telegram_data():
         raise
 
 
-@op(name="load_raw_to_postgres_op", description="Loads raw JSON data from data lake to PostgreSQL.")
+@op(name="ensure_raw_partitions_op", description="Creates the current and upcoming monthly partitions of the raw tables.",
+    out=Out(Nothing))
+def ensure_raw_partitions():
+    """
+    Executes partitions.py ensure before the loader and YOLO run, so their writes find this
+    month's partitions in place and rarely need to create one while other writers are running.
+    Fails if a raw table still exists unpartitioned, until `partitions.py migrate` is run.
+    """
+    logger = ensure_raw_partitions.log
+    logger.info("Ensuring raw table partitions...")
+    try:
+        command = ["python", str(SCRIPTS_DIR / "partitions.py"), "ensure", "--months-ahead", str(PARTITION_MONTHS_AHEAD)]
+        process = subprocess.run(command, capture_output=True, text=True, check=True)
+        logger.info(f"Partitions stdout:\n{process.stdout}")
+        if process.stderr:
+            logger.info(f"Partitions stderr:\n{process.stderr}")
+        logger.info("Raw table partitions are in place.")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Ensuring partitions failed: {e}")
+        logger.error(f"Partitions stdout:\n{e.stdout}")
+        logger.error(f"Partitions stderr:\n{e.stderr}")
+        raise
+    except FileNotFoundError:
+        logger.error("Python command not found. Is Python installed and in PATH?")
+        raise
+
+
+@op(name="load_raw_to_postgres_op", description="Loads raw JSON data from data lake to PostgreSQL.",
+    ins={"partitions_ready": In(Nothing)})
 def load_raw_to_postgres():
     """
     Executes the load_to_postgres.py script to load raw data into PostgreSQL.
@@ -75,8 +107,8 @@ def run_dbt_transformations():
     logger = run_dbt_transformations.log
     logger.info("Starting dbt transformations...")
     try:
-        # Run dbt models
-        dbt_run_command = ["dbt", "run"]
+        # Run dbt models (incremental models only process new data unless a full refresh is requested)
+        dbt_run_command = ["dbt", "run"] + (["--full-refresh"] if DBT_FULL_REFRESH else [])
         logger.info(f"Running dbt command: {' '.join(dbt_run_command)}")
         process_run = subprocess.run(dbt_run_command, cwd=DBT_DIR, capture_output=True, text=True, check=True)
         logger.info(f"dbt run stdout:\n{process_run.stdout}")
@@ -104,7 +136,8 @@ def run_dbt_transformations():
         raise
 
 
-@op(name="run_yolo_enrichment_op", description="Performs YOLO object detection on images and loads results.")
+@op(name="run_yolo_enrichment_op", description="Performs YOLO object detection on images and loads results.",
+    ins={"partitions_ready": In(Nothing)})
 def run_yolo_enrichment():
     """
     Executes the yolo_detection.py script to enrich data with YOLO results.
@@ -138,11 +171,13 @@ def telegram_data_pipeline():
     # Define dependencies:
     # 1. Scrape data first
     scrape_telegram_data()
-    # 2. Load raw data to Postgres (depends on scraping)
-    load_raw_to_postgres()
-    # 3. Run YOLO enrichment (depends on scraping, as it needs images)
-    run_yolo_enrichment()
-    # 4. Run dbt transformations (depends on raw data load and YOLO enrichment)
+    # 2. Create this month's raw table partitions before anything writes to them
+    partitions_ready = ensure_raw_partitions()
+    # 3. Load raw data to Postgres (depends on scraping)
+    load_raw_to_postgres(partitions_ready)
+    # 4. Run YOLO enrichment (depends on scraping, as it needs images)
+    run_yolo_enrichment(partitions_ready)
+    # 5. Run dbt transformations (depends on raw data load and YOLO enrichment)
     run_dbt_transformations()
 
 
@@ -0,0 +1,20 @@
+{#
+    Records that a dbt invocation has finished in marts.pipeline_runs and notifies listeners.
+    The API polls MAX(finished_at) from this table and clears its response cache when it changes.
+    Only invocations that can change the marts (run/build/seed/snapshot) are recorded.
+#}
+{% macro record_pipeline_run() %}
+    {% if flags.WHICH in ['run', 'build', 'seed', 'snapshot'] %}
+        CREATE SCHEMA IF NOT EXISTS marts;
+        CREATE TABLE IF NOT EXISTS marts.pipeline_runs (
+            invocation_id TEXT PRIMARY KEY,
+            finished_at TIMESTAMP NOT NULL
+        );
+        INSERT INTO marts.pipeline_runs (invocation_id, finished_at)
+        VALUES ('{{ invocation_id }}', CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+        ON CONFLICT (invocation_id) DO UPDATE SET finished_at = EXCLUDED.finished_at;
+        NOTIFY pipeline_runs;
+    {% else %}
+        SELECT 1;
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,30 @@
+{#
+    Incremental bookkeeping for fct_product_mentions, driven by the raw.mention_extractions
+    ledger. Every message whose mentions were (re-)extracted at or after the latest extracted_at
+    already in the fact table is rebuilt from raw.product_mentions. The ledger also covers
+    messages re-extracted down to zero mentions, and the delete drops products no longer
+    matched: the merge on (message_sk, product_name) only touches keys that have new rows.
+#}
+
+{% macro mention_extractions_watermark() %}
+    (SELECT COALESCE(MAX(extracted_at), '1900-01-01'::TIMESTAMP) FROM {{ this }})
+{% endmacro %}
+
+{% macro reextracted_messages() %}
+    SELECT message_id, channel_username
+    FROM {{ source('raw', 'mention_extractions') }}
+    WHERE extracted_at >= {{ mention_extractions_watermark() }}
+{% endmacro %}
+
+{% macro delete_reextracted_mentions() %}
+    {% if is_incremental() %}
+        DELETE FROM {{ this }}
+        WHERE message_sk IN (
+            SELECT stm.message_sk
+            FROM {{ ref('stg_telegram_messages') }} stm
+            WHERE (stm.message_id, stm.channel_username) IN ({{ reextracted_messages() }})
+        )
+    {% else %}
+        SELECT 1
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,34 @@
+{#
+    Incremental bookkeeping for fct_image_detections, driven by the raw.processed_images ledger.
+    Every (message_id, channel_username) whose image was processed at or after the latest
+    processed_at already in the fact table is rebuilt from raw.image_detections. The ledger
+    also covers images re-processed down to zero detections, whose stale fact rows would
+    otherwise survive: delete+insert only deletes keys that have new rows.
+#}
+
+{% macro processed_images_watermark() %}
+    {%- set columns = [] -%}
+    {%- if execute -%}
+        {%- set columns = adapter.get_columns_in_relation(this) | map(attribute='name') | list -%}
+    {%- endif -%}
+    {%- if 'processed_at' in columns -%}
+        (SELECT COALESCE(MAX(processed_at), '1900-01-01'::TIMESTAMP) FROM {{ this }})
+    {%- else -%}
+        '1900-01-01'::TIMESTAMP {#- Fact table built before processed_at was added: rebuild every processed message -#}
+    {%- endif -%}
+{% endmacro %}
+
+{% macro reprocessed_images() %}
+    SELECT message_id, channel_username
+    FROM {{ source('raw', 'processed_images') }}
+    WHERE processed_at >= {{ processed_images_watermark() }}
+{% endmacro %}
+
+{% macro delete_reprocessed_detections() %}
+    {% if is_incremental() %}
+        DELETE FROM {{ this }}
+        WHERE (message_id, channel_username) IN ({{ reprocessed_images() }})
+    {% else %}
+        SELECT 1
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,56 @@
+-- medical_dbt/models/marts/agg_channel_daily.sql
+
+-- Daily activity rollup: one row per (channel, day) with message, view, forward and photo totals.
+-- Backs /api/channels/{channel_username}/activity as an indexed range lookup instead of a
+-- GROUP BY over fct_messages on every request.
+-- Built incrementally: each run recomputes only the (channel, day) groups that received messages
+-- scraped since the last run (backfilled messages can land on any past day).
+
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['channel_username', 'activity_date'],
+    post_hook=[
+        "CREATE UNIQUE INDEX IF NOT EXISTS {{ this.name }}_channel_date_idx ON {{ this }} (channel_username, activity_date)"
+    ]
+) }}
+
+WITH
+{% if is_incremental() %}
+touched_days AS (
+    SELECT DISTINCT channel_username, message_date_sk
+    FROM {{ ref('fct_messages') }}
+    WHERE scrape_date_sk >= (SELECT COALESCE(MAX(last_scrape_date_sk), 0) FROM {{ this }})
+),
+{% endif %}
+daily AS (
+    SELECT
+        fm.channel_username,
+        fm.message_date_sk,
+        COUNT(*) AS message_count,
+        SUM(COALESCE(fm.views, 0)) AS total_views,
+        SUM(COALESCE(fm.forwards, 0)) AS total_forwards,
+        COUNT(*) FILTER (WHERE fm.has_photo) AS photo_count,
+        MAX(fm.scrape_date_sk) AS last_scrape_date_sk
+    FROM
+        {{ ref('fct_messages') }} fm
+    {% if is_incremental() %}
+    JOIN
+        touched_days td ON fm.channel_username = td.channel_username AND fm.message_date_sk = td.message_date_sk
+    {% endif %}
+    GROUP BY
+        fm.channel_username, fm.message_date_sk
+)
+
+SELECT
+    daily.channel_username,
+    dd.full_date AS activity_date,
+    daily.message_count,
+    daily.total_views,
+    daily.total_forwards,
+    daily.photo_count,
+    daily.last_scrape_date_sk -- Latest scrape in the group; drives the incremental filter
+FROM
+    daily
+JOIN
+    {{ ref('dim_dates') }} dd ON daily.message_date_sk = dd.date_sk
@@ -1,18 +1,44 @@
 -- medical_dbt/models/marts/fct_image_detections.sql
 
 -- Fact table for image detection results from YOLO.
+-- Built incrementally from the raw.processed_images ledger: each run first deletes the rows of
+-- every message whose image was (re)processed since the last run, then re-inserts whatever
+-- detections it has now, so boxes replaced by a new model version, or an image re-processed
+-- down to zero detections, do not linger (see macros/reprocessed_images.sql).
 
-{{ config(materialized='table') }}
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['message_id', 'channel_username'],
+    on_schema_change='append_new_columns',
+    pre_hook=["{{ delete_reprocessed_detections() }}"],
+    post_hook=[
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_message_idx ON {{ this }} (message_id, channel_username)",
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_detection_timestamp_idx ON {{ this }} (detection_timestamp)"
+    ]
+) }}
 
 SELECT
     -- Surrogate key for this fact, combining detection_id and detected_object_class
     {{ dbt_utils.generate_surrogate_key(['rid.detection_id', 'rid.detected_object_class']) }} AS image_detection_sk,
     
     fm.message_sk,         -- Foreign key to fct_messages
+    rid.message_id,
+    rid.channel_username,
     rid.detected_object_class,
     rid.confidence_score,
     rid.image_path,
     rid.detection_timestamp,
+    rpi.processed_at,      -- When the image was last processed (drives the incremental filter)
+
+    -- Bounding box in pixels and the size of the analysed image (NULL for rows detected before boxes were stored)
+    rid.box_index,
+    rid.box_x1,
+    rid.box_y1,
+    rid.box_x2,
+    rid.box_y2,
+    rid.image_width,
+    rid.image_height,
 
     -- Add a count metric for detections
     1 AS detection_count
@@ -21,6 +47,11 @@ FROM
     {{ source('raw', 'image_detections') }} rid
 LEFT JOIN
     {{ ref('fct_messages') }} fm ON rid.message_id = fm.message_id AND rid.channel_username = fm.channel_username
+LEFT JOIN
+    {{ source('raw', 'processed_images') }} rpi ON rid.message_id = rpi.message_id AND rid.channel_username = rpi.channel_username
+{% if is_incremental() %}
+WHERE (rid.message_id, rid.channel_username) IN ({{ reprocessed_images() }})
+{% endif %}
 -- Note: We are joining on message_id and channel_username.
 -- Ensure that the channel_username stored in raw.image_detections matches the one in fct_messages for joins to work.
 -- If your image filename parsing for channel_username is not robust, this join might fail.
@@ -3,7 +3,25 @@
 -- Fact table for Telegram messages.
 -- Contains key metrics and foreign keys to dimension tables.
 
-{{ config(materialized='table') }}
+-- Built incrementally: each run only merges messages scraped since the last run.
+-- Rebuild from scratch with `dbt run --full-refresh --select fct_messages` (or DBT_FULL_REFRESH=true in Dagster).
+
+-- GIN indexes back /api/search/messages: full-text (message_tsv) for word searches,
+-- trigram (pg_trgm) on message_text for substring ILIKE searches.
+{{ config(
+    materialized='incremental',
+    unique_key='message_sk',
+    pre_hook=[
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+    ],
+    post_hook=[
+        "CREATE UNIQUE INDEX IF NOT EXISTS {{ this.name }}_message_sk_idx ON {{ this }} (message_sk)",
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_scrape_date_sk_idx ON {{ this }} (scrape_date_sk)",
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_channel_date_idx ON {{ this }} (channel_username, message_date_sk)",
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_message_tsv_idx ON {{ this }} USING GIN (message_tsv)",
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_message_text_trgm_idx ON {{ this }} USING GIN (message_text gin_trgm_ops)"
+    ]
+) }}
 
 SELECT
     stm.message_sk, -- Surrogate key from staging, acts as primary key for this fact
@@ -20,6 +38,9 @@ SELECT
     stm.has_photo,
     stm.photo_path,
 
+    -- Search vector for /api/search/messages ('simple' config: no stemming, works for Amharic too)
+    TO_TSVECTOR('simple', COALESCE(stm.message_text, '')) AS message_tsv,
+
     -- Add any other relevant metrics or flags based on text content
     CASE WHEN stm.message_text ILIKE '%urgent%' THEN TRUE ELSE FALSE END AS is_urgent_message,
     CASE WHEN stm.message_text ILIKE '%vacancy%' THEN TRUE ELSE FALSE END AS is_vacancy_message,
@@ -33,3 +54,9 @@ LEFT JOIN
     {{ ref('dim_channels') }} dc ON stm.channel_username = dc.channel_username
 LEFT JOIN
     {{ ref('dim_dates') }} dd ON stm.message_date = dd.full_date
+{% if is_incremental() %}
+-- Only messages scraped since the last run (re-scan the last day to catch late loads)
+WHERE stm.scrape_date >= (
+    SELECT COALESCE(TO_DATE(MAX(scrape_date_sk)::TEXT, 'YYYYMMDD'), '1900-01-01'::DATE) FROM {{ this }}
+)
+{% endif %}
@@ -0,0 +1,42 @@
+-- medical_dbt/models/marts/fct_product_mentions.sql
+
+-- Fact table of medical product/drug mentions in Telegram messages.
+-- One row per (message, product) with the number of times the product is mentioned.
+-- Mentions are extracted at load time by scripts/product_matcher.py (single pass per message,
+-- Unicode-aware word boundaries) into raw.product_mentions; this model attaches message keys.
+-- Built incrementally from the raw.mention_extractions ledger: each run first deletes the rows of
+-- every message whose mentions were (re-)extracted since the last run, by a new load or a
+-- `load_to_postgres.py --extract-mentions` backfill, then re-inserts the mentions it has now, so
+-- products no longer matched do not linger (see macros/reextracted_mentions.sql).
+-- /api/reports/top-products is an indexed aggregate over this table.
+
+{{ config(
+    materialized='incremental',
+    unique_key=['message_sk', 'product_name'],
+    on_schema_change='append_new_columns',
+    pre_hook=["{{ delete_reextracted_mentions() }}"],
+    post_hook=[
+        "CREATE INDEX IF NOT EXISTS {{ this.name }}_product_idx ON {{ this }} (product_name) INCLUDE (mention_count)"
+    ]
+) }}
+
+SELECT
+    stm.message_sk,         -- Foreign key to fct_messages
+    stm.channel_username,
+    stm.message_date,
+    stm.scrape_date,
+    rpm.product_name,
+    rpm.mention_count,
+    rme.extracted_at       -- When the message's mentions were last extracted (drives the incremental filter)
+FROM
+    {{ source('raw', 'product_mentions') }} rpm
+JOIN
+    {{ ref('stg_telegram_messages') }} stm
+    ON rpm.message_id = stm.message_id AND rpm.channel_username = stm.channel_username
+JOIN
+    {{ source('raw', 'mention_extractions') }} rme
+    ON rpm.message_id = rme.message_id AND rpm.channel_username = rme.channel_username
+{% if is_incremental() %}
+-- Only messages extracted since the last run (>= rebuilds messages sharing the latest timestamp)
+WHERE (rpm.message_id, rpm.channel_username) IN ({{ reextracted_messages() }})
+{% endif %}
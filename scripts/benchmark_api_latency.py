@@ -0,0 +1,85 @@
+"""
+Load benchmark for the FastAPI service.
+
+Fires concurrent GET requests at one or more endpoints of a running API and reports
+throughput and p50/p99 latency per concurrency level. Run it once against the
+blocking build (every endpoint calling fetch_data on the event loop) and once
+against the current build to compare:
+
+    uvicorn api.main:app --port 8001 --workers 1
+    python scripts/benchmark_api_latency.py --base-url http://localhost:8001 --concurrency 1 8 32
+
+With blocking endpoints, latency grows linearly with concurrency because requests are
+served one at a time; with the executor-backed path it stays flat until the
+connection pool (DB_POOL_MAX_SIZE) is saturated.
+"""
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = [
+    "/api/channels",
+    "/api/reports/top-products?limit=10",
+    "/api/search/messages?query=paracetamol",
+    "/api/image-detections",
+]
+
+def timed_get(url, timeout):
+    """Issues a single GET request and returns (latency_seconds, ok)."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status < 500
+    except urllib.error.HTTPError as e:
+        ok = e.code < 500 # 404s are valid "no data" responses
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+def run_level(urls, concurrency, requests_total, timeout):
+    """Runs `requests_total` requests spread over `concurrency` threads."""
+    targets = [urls[i % len(urls)] for i in range(requests_total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda u: timed_get(u, timeout), targets))
+    elapsed = time.perf_counter() - start
+    latencies = [lat for lat, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "concurrency": concurrency,
+        "requests": requests_total,
+        "errors": errors,
+        "rps": requests_total / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent latency benchmark for the insights API.")
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    urls = [args.base_url.rstrip("/") + path for path in args.paths]
+    timed_get(urls[0], args.timeout) # Warm up the connection pool
+
+    print(f"{'conc':>5} {'reqs':>6} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for level in args.concurrency:
+        r = run_level(urls, level, args.requests, args.timeout)
+        print(f"{r['concurrency']:>5} {r['requests']:>6} {r['errors']:>6} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: per-row INSERT (the original loader) vs. COPY + single merge (bulk_insert_messages).
+
+Loads synthetic messages into a scratch table `bench.telegram_messages` shaped like
+raw.telegram_messages, so real data is never touched:
+
+    python scripts/benchmark_loader.py --messages 1000000 --legacy-messages 50000
+
+The legacy path is timed on a smaller sample (it needs one round trip per row) and its
+rate is extrapolated to the full message count.
+"""
+import argparse
+import random
+import time
+
+import psycopg2
+
+from load_to_postgres import db_params, create_raw_table, bulk_insert_messages, message_to_row, MESSAGE_COLUMNS
+
+BENCH_TABLE = 'bench.telegram_messages'
+
+def synthetic_messages(n, seed=42):
+    """Yield n message dicts in the scraper's JSON shape."""
+    rng = random.Random(seed)
+    channels = ['Chemed', 'Lobelia4Cosmetics', 'TikvahPharma']
+    for i in range(n):
+        text = f"Paracetamol 500mg tablet\tavailable now\nprice {rng.randint(50, 900)} birr ዋጋ"
+        yield {
+            'message_id': i,
+            'channel': channels[i % len(channels)],
+            'date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'text': text,
+            'views': rng.randint(0, 10000),
+            'forwards': rng.randint(0, 100),
+            'has_photo': i % 4 == 0,
+            'photo_path': f"data/images/Chemed_{i}.jpg" if i % 4 == 0 else None,
+        }
+
+def reset_bench_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE SCHEMA IF NOT EXISTS bench;
+            DROP TABLE IF EXISTS {BENCH_TABLE};
+            CREATE TABLE {BENCH_TABLE} (LIKE raw.telegram_messages INCLUDING ALL);
+        """)
+    conn.commit()
+
+def legacy_load(conn, rows):
+    """The original loader: one INSERT ... ON CONFLICT round trip per message."""
+    placeholders = ', '.join(['%s'] * len(MESSAGE_COLUMNS))
+    inserted = 0
+    with conn.cursor() as cur:
+        for row in rows:
+            cur.execute(f"""
+                INSERT INTO {BENCH_TABLE} ({', '.join(MESSAGE_COLUMNS)}) VALUES ({placeholders})
+                ON CONFLICT DO NOTHING
+            """, row)
+            inserted += cur.rowcount
+    conn.commit()
+    return inserted
+
+def bulk_load(conn, rows):
+    with conn.cursor() as cur:
+        _, inserted = bulk_insert_messages(cur, rows, target_table=BENCH_TABLE)
+    conn.commit()
+    return inserted
+
+def timed(label, func, conn, n):
+    reset_bench_table(conn)
+    rows = (message_to_row(msg, '2025-01-01') for msg in synthetic_messages(n))
+    start = time.perf_counter()
+    inserted = func(conn, rows)
+    elapsed = time.perf_counter() - start
+    rate = n / elapsed if elapsed else 0.0
+    print(f"{label:<8} {n:>10} rows  {elapsed:9.2f} s  {rate:12.0f} rows/s  ({inserted} inserted)")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raw message loader.")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--legacy-messages", type=int, default=50_000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        create_raw_table(conn)
+        legacy_rate = timed("legacy", legacy_load, conn, args.legacy_messages)
+        bulk_rate = timed("copy", bulk_load, conn, args.messages)
+        print(f"legacy extrapolated to {args.messages} rows: {args.messages / legacy_rate:.1f} s")
+        print(f"speedup: {bulk_rate / legacy_rate:.1f}x")
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        conn.commit()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Microbenchmark: single-pass ProductMatcher vs. the original per-word keyword loop
+that get_top_products used to run for every message.
+
+    python scripts/benchmark_product_matcher.py --messages 5000
+
+Runs on synthetic messages, needs no database.
+"""
+import argparse
+import random
+import re
+import time
+from collections import Counter
+
+from product_matcher import ProductMatcher, load_dictionary
+
+FILLER_WORDS = [
+    "available", "now", "price", "birr", "call", "order", "delivery", "new", "stock",
+    "original", "quality", "addis", "ababa", "pharmacy", "contact", "ዋጋ", "አዲስ", "አበባ",
+]
+
+def legacy_count(messages, medical_keywords):
+    """The original get_top_products loop (phrase check repeated for every word)."""
+    all_words = []
+    for text in messages:
+        text = text.lower()
+        words = re.findall(r'\b\w+\b', text)
+        for word in words:
+            if word in medical_keywords:
+                all_words.append(word)
+            for keyword in medical_keywords:
+                if len(keyword.split()) > 1 and keyword in text:
+                    all_words.append(keyword)
+    return Counter(all_words)
+
+def matcher_count(messages, matcher):
+    """Counts mentions with the single-pass matcher."""
+    counts = Counter()
+    for text in messages:
+        counts.update(matcher.find_all(text))
+    return counts
+
+def synthetic_messages(keywords, n, words_per_message, seed=42):
+    rng = random.Random(seed)
+    vocabulary = FILLER_WORDS + keywords
+    messages = []
+    for _ in range(n):
+        words = [rng.choice(vocabulary) for _ in range(words_per_message)]
+        messages.append(' '.join(w.upper() if rng.random() < 0.1 else w for w in words))
+    return messages
+
+def best_of(func, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark product mention extraction.")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=60, help="Words per synthetic message")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    keywords = load_dictionary()
+    matcher = ProductMatcher(keywords)
+    messages = synthetic_messages(keywords, args.messages, args.words)
+
+    legacy_time, legacy = best_of(lambda: legacy_count(messages, keywords), args.repeats)
+    matcher_time, matched = best_of(lambda: matcher_count(messages, matcher), args.repeats)
+
+    print(f"messages={args.messages} words/message={args.words} keywords={len(keywords)}")
+    print(f"legacy loop : {legacy_time * 1000:9.1f} ms  ({sum(legacy.values())} mentions)")
+    print(f"matcher     : {matcher_time * 1000:9.1f} ms  ({sum(matched.values())} mentions)")
+    print(f"speedup     : {legacy_time / matcher_time:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: per-image YOLO loop (the original yolo_detection) vs. batched inference with
+prefetched decoding (run_batched_inference).
+
+    python scripts/benchmark_yolo.py --images 200 --batch-sizes 1 8 16 32
+
+Uses images from data/images (recursively, so the content-addressed store is included)
+and needs no database.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from ultralytics import YOLO
+
+from yolo_detection import IMAGE_DIR, YOLO_MODEL_PATH, YOLO_DECODE_WORKERS, run_batched_inference
+
+def find_images(limit):
+    images = sorted(p for p in IMAGE_DIR.rglob('*') if p.suffix.lower() in ['.jpg', '.jpeg', '.png'])
+    return [str(p) for p in images[:limit]]
+
+def per_image_loop(model, image_paths):
+    """The original loop: one model call per image path, decoding inline."""
+    for image_path in image_paths:
+        model(image_path, verbose=False)
+
+def batched(model, image_paths, batch_size, workers):
+    for _ in run_batched_inference(model, image_paths, batch_size, workers):
+        pass
+
+def report(label, n, elapsed):
+    print(f"{label:<24} {n:>6} images  {elapsed:8.2f} s  {n / elapsed:8.1f} images/s")
+    return n / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark YOLO inference throughput.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 16, 32])
+    parser.add_argument("--decode-workers", type=int, default=YOLO_DECODE_WORKERS)
+    parser.add_argument("--model", default=YOLO_MODEL_PATH)
+    args = parser.parse_args()
+
+    image_paths = find_images(args.images)
+    if not image_paths:
+        print(f"No images found under {IMAGE_DIR}")
+        return
+    model = YOLO(args.model)
+    model(image_paths[0], verbose=False) # Warm up
+
+    start = time.perf_counter()
+    per_image_loop(model, image_paths)
+    baseline = report("per-image loop", len(image_paths), time.perf_counter() - start)
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        batched(model, image_paths, batch_size, args.decode_workers)
+        rate = report(f"batched (batch={batch_size})", len(image_paths), time.perf_counter() - start)
+        print(f"{'':<24} speedup {rate / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
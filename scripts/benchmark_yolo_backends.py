@@ -0,0 +1,100 @@
+"""
+Benchmark: accuracy vs. speed of the YOLO inference backends (PyTorch, ONNX Runtime,
+OpenVINO, optionally INT8-quantized) on a sample of scraped images.
+
+    python scripts/benchmark_yolo_backends.py --images 200 --backends torch onnx onnx-int8 openvino openvino-int8
+
+Throughput is measured with batched inference, the way yolo_detection runs. Accuracy is
+reported as agreement with the PyTorch model: a box counts as matched when a box of the
+same class overlaps it with IoU >= --iou. Needs no database; exported models are cached in
+YOLO_MODEL_CACHE_DIR, so only the first run pays for the export.
+"""
+import argparse
+import time
+
+from yolo_detection import YOLO_BATCH_SIZE, YOLO_DECODE_WORKERS, iter_decoded_batches, load_model
+from benchmark_yolo import find_images
+
+def parse_backend(name):
+    """'openvino-int8' -> ('openvino', True)."""
+    backend, _, quantization = name.partition('-')
+    return backend, quantization == 'int8'
+
+def predict(model, image_paths, batch_size, workers):
+    """Returns ({image_path: [(class, confidence, (x1, y1, x2, y2)), ...]}, elapsed seconds)."""
+    predictions = {}
+    start = time.perf_counter()
+    for batch in iter_decoded_batches(image_paths, batch_size, workers):
+        decoded = [(path, image) for path, image in batch if not isinstance(image, Exception)]
+        if not decoded:
+            continue
+        results = model([image for _, image in decoded], verbose=False)
+        for (path, _), result in zip(decoded, results):
+            predictions[path] = [
+                (model.names[int(box.cls[0])], float(box.conf[0]), tuple(float(v) for v in box.xyxy[0]))
+                for box in result.boxes or []
+            ]
+    return predictions, time.perf_counter() - start
+
+def iou(a, b):
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+def agreement(reference, candidate, iou_threshold):
+    """Greedy same-class IoU matching against the reference. Returns (precision, recall, mean |conf diff|)."""
+    matched = reference_total = candidate_total = 0
+    confidence_diffs = []
+    for path, reference_boxes in reference.items():
+        candidate_boxes = list(candidate.get(path, []))
+        reference_total += len(reference_boxes)
+        candidate_total += len(candidate_boxes)
+        for ref_class, ref_conf, ref_box in sorted(reference_boxes, key=lambda d: -d[1]):
+            best, best_iou = None, iou_threshold
+            for i, (cls, conf, box) in enumerate(candidate_boxes):
+                overlap = iou(ref_box, box)
+                if cls == ref_class and overlap >= best_iou:
+                    best, best_iou = i, overlap
+            if best is not None:
+                matched += 1
+                confidence_diffs.append(abs(candidate_boxes.pop(best)[1] - ref_conf))
+    precision = matched / candidate_total if candidate_total else 1.0
+    recall = matched / reference_total if reference_total else 1.0
+    mean_diff = sum(confidence_diffs) / len(confidence_diffs) if confidence_diffs else 0.0
+    return precision, recall, mean_diff
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare YOLO inference backends for accuracy and speed.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", default=['torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8'])
+    parser.add_argument("--batch-size", type=int, default=YOLO_BATCH_SIZE)
+    parser.add_argument("--decode-workers", type=int, default=YOLO_DECODE_WORKERS)
+    parser.add_argument("--iou", type=float, default=0.5)
+    args = parser.parse_args()
+
+    image_paths = find_images(args.images)
+    if not image_paths:
+        print("No images found to benchmark.")
+        return
+
+    reference, baseline_rate = None, None
+    print(f"{'backend':<16} {'images/s':>9} {'speedup':>8} {'precision':>10} {'recall':>8} {'|dconf|':>8}")
+    for name in ['torch'] + [b for b in args.backends if b != 'torch']:
+        backend, int8 = parse_backend(name)
+        try:
+            model = load_model(backend, int8)
+        except Exception as e:
+            print(f"{name:<16} unavailable: {e}")
+            continue
+        model(image_paths[:1], verbose=False) # Warm up
+        predictions, elapsed = predict(model, image_paths, args.batch_size, args.decode_workers)
+        rate = len(image_paths) / elapsed
+        if reference is None:
+            reference, baseline_rate = predictions, rate
+        precision, recall, conf_diff = agreement(reference, predictions, args.iou)
+        print(f"{name:<16} {rate:9.1f} {rate / baseline_rate:7.2f}x {precision:10.3f} {recall:8.3f} {conf_diff:8.4f}")
+
+if __name__ == "__main__":
+    main()
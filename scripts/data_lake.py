@@ -0,0 +1,92 @@
+import gzip
+import json
+import os
+from itertools import islice
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError: # zstd compression is optional
+    zstandard = None
+
+# Compression for newly written lake files: 'none', 'gzip' or 'zstd'
+LAKE_COMPRESSION = os.getenv('LAKE_COMPRESSION', 'none').lower()
+
+# File patterns the loader picks up: NDJSON (optionally compressed) and legacy JSON arrays
+LAKE_FILE_PATTERNS = ['*.jsonl', '*.jsonl.gz', '*.jsonl.zst', '*.json']
+
+def lake_filename(channel_name, compression=LAKE_COMPRESSION):
+    """Returns the data lake file name for a channel under the given compression."""
+    suffix = {'none': '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}.get(compression)
+    if suffix is None:
+        raise ValueError(f"Unsupported LAKE_COMPRESSION: {compression}")
+    return f"{channel_name}{suffix}"
+
+def _open_text(path, mode):
+    """Opens a lake file in text mode, transparently handling .gz and .zst."""
+    path = Path(path)
+    name = path.name.removesuffix('.part')
+    if name.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if name.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is not installed; cannot open {path}")
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return path.open(mode, encoding='utf-8')
+
+class NDJSONWriter:
+    """
+    Appends one JSON object per line to a lake file as messages arrive.
+    Writes go to a `.part` file that is renamed into place on close, so a
+    loader never sees a half-written channel file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._part_path = self.path.with_name(self.path.name + '.part')
+        self._file = _open_text(self._part_path, 'w')
+        self.count = 0
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write('\n')
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+        os.replace(self._part_path, self.path)
+
+    def abort(self):
+        """Discards the partially written file."""
+        self._file.close()
+        self._part_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def iter_messages(path):
+    """
+    Yields message dicts from a lake file one at a time.
+    NDJSON files are streamed line by line; legacy `.json` array files are read whole.
+    """
+    path = Path(path)
+    if path.suffix == '.json':
+        with path.open('r', encoding='utf-8') as f:
+            yield from json.load(f) or []
+        return
+    with _open_text(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_batches(iterable, batch_size):
+    """Groups an iterable into lists of at most batch_size items."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError: # Perceptual dedup is optional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed image store: data/images/store/<h[:2]>/<h[2:4]>/<sha256>.jpg
+IMAGE_STORE_PATH = Path(os.getenv('IMAGE_STORE_PATH', 'data/images/store'))
+# Append-only manifest mapping (channel, message_id) to the content hash of its photo
+IMAGE_MANIFEST_PATH = Path(os.getenv('IMAGE_MANIFEST_PATH', 'data/images/manifest.jsonl'))
+# Perceptual dedup: treat re-encoded/resized copies of a photo as the same image
+PERCEPTUAL_DEDUP = os.getenv('PERCEPTUAL_DEDUP', 'false').lower() == 'true'
+# Maximum Hamming distance between 64-bit dHashes for two photos to count as duplicates
+PERCEPTUAL_HASH_THRESHOLD = int(os.getenv('PERCEPTUAL_HASH_THRESHOLD', '4'))
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with Path(path).open('rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def dhash(path, hash_size=8):
+    """64-bit difference hash: stable across re-encoding, resizing and small recompression."""
+    with Image.open(path) as img:
+        pixels = list(img.convert('L').resize((hash_size + 1, hash_size)).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+def iter_manifest(path=IMAGE_MANIFEST_PATH):
+    """Yields manifest entries; later entries for the same (channel, message_id) supersede earlier ones."""
+    if not path.exists():
+        return
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def read_manifest_since(path=IMAGE_MANIFEST_PATH, offset=0):
+    """
+    Returns (entries, end_offset) for the manifest entries appended after byte `offset`,
+    so a consumer can remember end_offset and only read newer entries next time.
+    A trailing line that is still being written is left for the next read.
+    """
+    entries = []
+    if not path.exists():
+        return entries, 0
+    if offset > path.stat().st_size: # Manifest was rewritten; start over
+        offset = 0
+    with path.open('rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries, offset
+
+def load_manifest(path=IMAGE_MANIFEST_PATH):
+    """Returns {(channel, message_id): entry} for every photo recorded in the manifest."""
+    return {(entry['channel'], entry['message_id']): entry for entry in iter_manifest(path)}
+
+class ImageStore:
+    """
+    Stores each distinct photo once under a path derived from its SHA-256, and records in
+    the manifest which (channel, message_id) references which content hash. Reposted
+    photos therefore take no extra disk space and are run through YOLO only once.
+    With perceptual dedup enabled, a photo whose dHash is within PERCEPTUAL_HASH_THRESHOLD
+    bits of a stored photo is mapped to that photo instead of being stored again.
+    """
+
+    def __init__(self, root=IMAGE_STORE_PATH, manifest_path=IMAGE_MANIFEST_PATH,
+                 perceptual=PERCEPTUAL_DEDUP, threshold=PERCEPTUAL_HASH_THRESHOLD):
+        self.root = Path(root)
+        self.manifest_path = Path(manifest_path)
+        if perceptual and Image is None:
+            logger.warning("PERCEPTUAL_DEDUP requested but Pillow is not installed; using exact dedup only.")
+            perceptual = False
+        self.perceptual = perceptual
+        self.threshold = threshold
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._entries = load_manifest(self.manifest_path)
+        # Perceptual hash -> content hash of the stored photo it belongs to
+        self._phashes = {e['phash']: e['content_hash'] for e in self._entries.values() if e.get('phash')}
+
+    def path_for(self, content_hash):
+        return self.root / content_hash[:2] / content_hash[2:4] / f"{content_hash}.jpg"
+
+    def lookup(self, channel, message_id):
+        """Returns the manifest entry for a message's photo, or None if it is not stored yet."""
+        entry = self._entries.get((channel, message_id))
+        if entry and Path(entry['image_path']).exists():
+            return entry
+        return None
+
+    def _find_near_duplicate(self, phash):
+        if phash in self._phashes:
+            return self._phashes[phash]
+        if self.threshold > 0:
+            for known, content_hash in self._phashes.items():
+                if hamming(phash, known) <= self.threshold:
+                    return content_hash
+        return None
+
+    def put(self, channel, message_id, tmp_path):
+        """
+        Moves a freshly downloaded file into the store (or discards it if the same photo
+        is already stored) and records the message in the manifest. Returns the entry.
+        """
+        tmp_path = Path(tmp_path)
+        content_hash = file_sha256(tmp_path)
+        final_path = self.path_for(content_hash)
+        phash = None
+        duplicate = final_path.exists()
+
+        if not duplicate and self.perceptual:
+            try:
+                phash = dhash(tmp_path)
+                near = self._find_near_duplicate(phash)
+                if near is not None:
+                    content_hash, final_path, duplicate = near, self.path_for(near), True
+            except Exception as e:
+                logger.warning(f"Could not compute perceptual hash for {tmp_path}: {e}")
+
+        if duplicate:
+            tmp_path.unlink(missing_ok=True)
+        else:
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, final_path)
+            if phash:
+                self._phashes[phash] = content_hash
+
+        entry = {
+            'channel': channel,
+            'message_id': message_id,
+            'content_hash': content_hash,
+            'phash': phash,
+            'image_path': str(final_path),
+            'duplicate': duplicate,
+        }
+        self._entries[(channel, message_id)] = entry
+        with self.manifest_path.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry
@@ -1,12 +1,19 @@
-import json
+import io
+import argparse
 import logging
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import util as mp_util
 import psycopg2
 from psycopg2.extras import execute_batch
-from dotenv import load_dotenv
 import os
 
+from product_matcher import ProductMatcher, DEFAULT_DICTIONARY_PATH
+from data_lake import LAKE_FILE_PATTERNS, iter_messages, iter_batches
+from partitions import ensure_partitions
+from raw_schema import db_params, RAW_MESSAGES_DDL
+
 # Configure logging
 LOG_DIR = Path('logs/')
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -17,19 +24,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv(load_dotenv(dotenv_path=Path(__file__).parent.parent / '.env'))
-db_params = {
-    'dbname': os.getenv('POSTGRES_DB'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD'),
-    'host': os.getenv('POSTGRES_HOST'),
-    'port': os.getenv('POSTGRES_PORT')
-}
-
 # Data lake path
 BASE_DATA_PATH = Path('data/raw/telegram_messages')
 
+# Rows per COPY round trip when bulk loading
+COPY_BATCH_SIZE = int(os.getenv('LOAD_COPY_BATCH_SIZE', '50000'))
+
+# Messages held in memory at once while streaming a lake file
+LOAD_BATCH_SIZE = int(os.getenv('LOAD_BATCH_SIZE', '10000'))
+
+# Parallel loader processes, each with its own connection (1 = load files sequentially)
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', str(os.cpu_count() or 1)))
+
+# Product dictionary used to extract product mentions at load time
+PRODUCT_DICTIONARY_PATH = Path(os.getenv('PRODUCT_DICTIONARY_PATH', DEFAULT_DICTIONARY_PATH))
+
 # Channel name to username mapping
 CHANNEL_USERNAME_MAP = {
     'Chemed': '@CheMed123',
@@ -41,91 +50,338 @@ def create_raw_table(conn):
     """Create raw.telegram_messages table if it doesn't exist."""
     try:
         with conn.cursor() as cur:
+            cur.execute(RAW_MESSAGES_DDL)
+        conn.commit()
+        logger.info("Created raw.telegram_messages table")
+    except Exception as e:
+        logger.error(f"Error creating table: {e}")
+        conn.rollback()
+
+def create_mentions_table(conn):
+    """
+    Create raw.product_mentions and raw.mention_extractions if they don't exist. The latter
+    records when each message's mentions were last extracted, including messages with none,
+    so fct_product_mentions can rebuild exactly the messages that were re-extracted.
+    A newly created ledger is seeded from the mentions already extracted.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('raw.mention_extractions') IS NULL;")
+            is_new = cur.fetchone()[0]
             cur.execute("""
                 CREATE SCHEMA IF NOT EXISTS raw;
-                CREATE TABLE IF NOT EXISTS raw.telegram_messages (
+                CREATE TABLE IF NOT EXISTS raw.product_mentions (
                     message_id BIGINT,
-                    channel_name VARCHAR(255),
                     channel_username VARCHAR(255),
-                    scrape_date DATE,
-                    message_date DATE,
-                    message_text TEXT,
-                    message_length INTEGER,
-                    views INTEGER,
-                    forwards INTEGER,
-                    has_photo BOOLEAN,
-                    photo_path TEXT,
+                    product_name VARCHAR(255),
+                    mention_count INTEGER,
+                    PRIMARY KEY (message_id, channel_username, product_name)
+                );
+                -- When the mention was (re-)extracted; drives the incremental fct_product_mentions model
+                ALTER TABLE raw.product_mentions
+                    ADD COLUMN IF NOT EXISTS extracted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+                CREATE INDEX IF NOT EXISTS idx_product_mentions_extracted_at
+                    ON raw.product_mentions (extracted_at);
+                CREATE TABLE IF NOT EXISTS raw.mention_extractions (
+                    message_id BIGINT NOT NULL,
+                    channel_username VARCHAR(255) NOT NULL,
+                    extracted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                     PRIMARY KEY (message_id, channel_username)
                 );
+                CREATE INDEX IF NOT EXISTS idx_mention_extractions_extracted_at
+                    ON raw.mention_extractions (extracted_at);
             """)
+            if is_new:
+                cur.execute("""
+                    INSERT INTO raw.mention_extractions (message_id, channel_username, extracted_at)
+                    SELECT message_id, channel_username, MAX(extracted_at)
+                    FROM raw.product_mentions
+                    GROUP BY message_id, channel_username
+                    ON CONFLICT DO NOTHING;
+                """)
         conn.commit()
-        logger.info("Created raw.telegram_messages table")
+        logger.info("Created raw.product_mentions table")
     except Exception as e:
         logger.error(f"Error creating table: {e}")
         conn.rollback()
 
-def load_json_to_postgres(json_file, conn):
-    """Load a JSON file into raw.telegram_messages table."""
-    try:
-        with json_file.open('r', encoding='utf-8') as f:
-            messages = json.load(f)
+MENTIONS_UPSERT_SQL = """
+    INSERT INTO raw.product_mentions (message_id, channel_username, product_name, mention_count)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (message_id, channel_username, product_name)
+    DO UPDATE SET mention_count = EXCLUDED.mention_count, extracted_at = EXCLUDED.extracted_at
+"""
 
-        if not messages:
-            logger.info(f"No messages found in {json_file}. Skipping.")
-            return
+def replace_mentions(cur, keys, rows):
+    """
+    Replaces the mention rows of the messages in `keys` ((message_id, channel_username) pairs)
+    with `rows`, so products no longer matched are dropped, and records the extraction in
+    raw.mention_extractions. Returns the number of mention rows written.
+    """
+    keys = list(dict.fromkeys(keys))
+    message_ids = [key[0] for key in keys]
+    channel_usernames = [key[1] for key in keys]
+    cur.execute("""
+        DELETE FROM raw.product_mentions pm
+        USING unnest(%s::BIGINT[], %s::VARCHAR[]) AS m(message_id, channel_username)
+        WHERE pm.message_id = m.message_id AND pm.channel_username = m.channel_username
+    """, (message_ids, channel_usernames))
+    execute_batch(cur, MENTIONS_UPSERT_SQL, rows, page_size=1000)
+    cur.execute("""
+        INSERT INTO raw.mention_extractions (message_id, channel_username)
+        SELECT * FROM unnest(%s::BIGINT[], %s::VARCHAR[])
+        ON CONFLICT (message_id, channel_username) DO UPDATE SET extracted_at = CURRENT_TIMESTAMP
+    """, (message_ids, channel_usernames))
+    return len(rows)
+
+# Bulk loads stage rows here. The columns are spelled out instead of copied with LIKE: LIKE
+# would lock the target before its partitions are ensured, and would carry over message_date's
+# NOT NULL, so one undated message would fail the whole COPY instead of being skipped.
+STAGING_DDL = """
+    CREATE TEMP TABLE tmp_telegram_messages (
+        message_id BIGINT,
+        channel_name VARCHAR(255),
+        channel_username VARCHAR(255),
+        scrape_date DATE,
+        message_date DATE,
+        message_text TEXT,
+        message_length INTEGER,
+        views INTEGER,
+        forwards INTEGER,
+        has_photo BOOLEAN,
+        photo_path TEXT
+    ) ON COMMIT DROP
+"""
+
+MESSAGE_COLUMNS = [
+    'message_id', 'channel_name', 'channel_username', 'scrape_date', 'message_date',
+    'message_text', 'message_length', 'views', 'forwards', 'has_photo', 'photo_path'
+]
+
+def message_to_row(msg, scrape_date):
+    """Map a scraped message dict to a raw.telegram_messages row (in MESSAGE_COLUMNS order)."""
+    return (
+        msg['message_id'],
+        msg['channel'],
+        CHANNEL_USERNAME_MAP.get(msg['channel'], msg['channel']),
+        scrape_date,
+        msg['date'],  # message_date from JSON
+        msg['text'],
+        len(msg['text'] or ''),
+        msg['views'],
+        msg['forwards'],
+        msg['has_photo'],
+        msg['photo_path']
+    )
+
+def _copy_value(value):
+    """Format a value for COPY's text format (tab-separated, \\N for NULL)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def copy_rows(cur, table, columns, rows, batch_size=COPY_BATCH_SIZE):
+    """Stream rows into a table with COPY, one round trip per batch. Returns the number of rows copied."""
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    copied = pending = 0
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row))
+        buffer.write('\n')
+        pending += 1
+        if pending >= batch_size:
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+            copied += pending
+            pending = 0
+            buffer = io.StringIO()
+    if pending:
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+        copied += pending
+    return copied
+
+def bulk_insert_messages(cur, rows, target_table='raw.telegram_messages'):
+    """
+    COPY rows into a temporary staging table, then merge them into the target table
+    with a single INSERT ... SELECT ... ON CONFLICT DO NOTHING, creating any monthly
+    partitions the batch needs first. Messages without a date cannot be placed and are skipped.
+    Must start a transaction that has not yet touched the target (see ensure_partitions).
+    Returns (staged, inserted); staged - inserted rows already existed.
+    """
+    columns = ', '.join(MESSAGE_COLUMNS)
+    cur.execute(STAGING_DDL)
+    staged = copy_rows(cur, 'tmp_telegram_messages', MESSAGE_COLUMNS, rows)
+    cur.execute("SELECT DISTINCT date_trunc('month', message_date)::DATE FROM tmp_telegram_messages")
+    ensure_partitions(cur, target_table, [month for (month,) in cur.fetchall()],
+                      connect=lambda: psycopg2.connect(**db_params))
+    cur.execute(f"""
+        INSERT INTO {target_table} ({columns})
+        SELECT {columns} FROM tmp_telegram_messages
+        WHERE message_date IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    inserted = cur.rowcount
+    cur.execute("DROP TABLE tmp_telegram_messages")
+    return staged, inserted
+
+def extract_mentions(messages, matcher):
+    """Build (message_id, channel_username, product_name, mention_count) rows for messages."""
+    rows = []
+    for msg in messages:
+        channel_username = CHANNEL_USERNAME_MAP.get(msg['channel'], msg['channel'])
+        for product, count in matcher.count(msg['text']).items():
+            rows.append((msg['message_id'], channel_username, product, count))
+    return rows
+
+def load_json_to_postgres(json_file, conn, matcher=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Load a data lake file (NDJSON, optionally compressed, or a legacy JSON array) into
+    raw.telegram_messages (and its product mentions into raw.product_mentions).
+    Messages are streamed in fixed-size batches, so memory stays bounded per file. Each batch
+    is committed on its own, so partitions a later batch needs can be created between them;
+    re-loading a partly loaded file is safe, as existing messages are skipped.
+    Returns a per-file result dict with recorded/skipped counts and any error.
+    """
+    result = {'file': str(json_file), 'recorded': 0, 'skipped': 0, 'error': None}
+    try:
+        scrape_date = datetime.now().strftime('%Y-%m-%d')
         recorded = skipped = 0
         with conn.cursor() as cur:
-            for msg in messages:
-                scrape_date = datetime.now().strftime('%Y-%m-%d')
-                cur.execute("""
-                    INSERT INTO raw.telegram_messages (
-                        message_id, channel_name, channel_username, scrape_date, message_date,
-                        message_text, message_length, views, forwards, has_photo, photo_path
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (message_id, channel_username) DO NOTHING
-                    """, (
-                        msg['message_id'],
-                        msg['channel'],
-                        CHANNEL_USERNAME_MAP.get(msg['channel'], msg['channel']),
-                        scrape_date,  
-                        msg['date'],  # message_date from JSON
-                        msg['text'],
-                        len(msg['text'] or ''),
-                        msg['views'],
-                        msg['forwards'],
-                        msg['has_photo'],
-                        msg['photo_path']
-                    )
-                    )
-                if cur.rowcount == 1:
-                    recorded += 1
-                else:
-                    skipped += 1
-
-            conn.commit()
+            for messages in iter_batches(iter_messages(json_file), batch_size):
+                staged, inserted = bulk_insert_messages(cur, (message_to_row(msg, scrape_date) for msg in messages))
+                recorded += inserted
+                skipped += staged - inserted
+
+                if matcher is not None:
+                    keys = [(msg['message_id'], CHANNEL_USERNAME_MAP.get(msg['channel'], msg['channel'])) for msg in messages]
+                    replace_mentions(cur, keys, extract_mentions(messages, matcher))
+                conn.commit()
+        result.update(recorded=recorded, skipped=skipped)
+        if recorded + skipped == 0:
+            logger.info(f"No messages found in {json_file}. Skipping.")
+            return result
         logger.info(f"Loaded {recorded} messages from {json_file} to PostgreSQL, {skipped} skipped")
     except Exception as e:
         logger.error(f"Error loading {json_file}: {e}")
         conn.rollback()
+        result['error'] = str(e)
+    return result
+
+def backfill_mentions(conn, matcher, batch_size=LOAD_BATCH_SIZE):
+    """
+    Re-extracts product mentions for every message already in raw.telegram_messages, e.g. after
+    deploying the loader-side matcher or changing the product dictionary. Messages are streamed
+    through a server-side cursor on a separate read connection, batch_size at a time; each
+    batch replaces its messages' mention rows and is committed on its own, so the backfill
+    can be interrupted and re-run. Returns (messages scanned, mention rows written).
+    """
+    scanned = written = 0
+    read_conn = psycopg2.connect(**db_params)
+    try:
+        with read_conn.cursor(name='backfill_mentions') as source, conn.cursor() as cur:
+            source.itersize = batch_size
+            source.execute("SELECT message_id, channel_username, message_text FROM raw.telegram_messages")
+            while True:
+                batch = source.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows = [
+                    (message_id, channel_username, product, count)
+                    for message_id, channel_username, text in batch
+                    for product, count in matcher.count(text).items()
+                ]
+                written += replace_mentions(cur, [(row[0], row[1]) for row in batch], rows)
+                conn.commit()
+                scanned += len(batch)
+                logger.info(f"Backfilled mentions for {scanned} messages ({written} mention rows)")
+    except Exception as e:
+        logger.error(f"Error backfilling product mentions: {e}")
+        conn.rollback()
+        raise
+    finally:
+        read_conn.close()
+    return scanned, written
+
+# --- Parallel loading: one connection and matcher per worker process ---
+_worker_conn = None
+_worker_matcher = None
+
+def _init_worker():
+    """Open this worker's own connection and build its product matcher."""
+    global _worker_conn, _worker_matcher
+    _worker_conn = psycopg2.connect(**db_params)
+    # Close it when the worker exits; forked workers leave through os._exit, skipping atexit
+    mp_util.Finalize(None, _worker_conn.close, exitpriority=10)
+    _worker_matcher = ProductMatcher.from_csv(PRODUCT_DICTIONARY_PATH)
+
+def _load_file_in_worker(json_file):
+    return load_json_to_postgres(json_file, _worker_conn, _worker_matcher)
 
-def main():
-    """Load all JSON files from data lake to PostgreSQL."""
+def load_files_parallel(json_files, workers=LOAD_WORKERS):
+    """Load files concurrently across worker processes. Returns one result dict per file."""
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(_load_file_in_worker, f): f for f in json_files}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e: # Worker crashed or could not connect
+                logger.error(f"Worker failed on {futures[future]}: {e}")
+                results.append({'file': str(futures[future]), 'recorded': 0, 'skipped': 0, 'error': str(e)})
+    return results
+
+def log_load_summary(results):
+    """Log per-file outcomes and overall totals."""
+    failed = [r for r in results if r['error']]
+    for r in failed:
+        logger.error(f"Failed to load {r['file']}: {r['error']}")
+    logger.info(
+        f"Load summary: {len(results) - len(failed)}/{len(results)} files loaded, "
+        f"{sum(r['recorded'] for r in results)} messages recorded, "
+        f"{sum(r['skipped'] for r in results)} skipped"
+    )
+
+def main(backfill=False):
+    """Load all JSON files from data lake to PostgreSQL, or backfill product mentions."""
     try:
         # Connect to PostgreSQL
         conn = psycopg2.connect(**db_params)
         logger.info("Connected to PostgreSQL database: telegram_medical_data")
         
-        # Create raw table
+        # Create raw tables
         create_raw_table(conn)
+        create_mentions_table(conn)
+
+        # Build the product matcher once for all files
+        matcher = ProductMatcher.from_csv(PRODUCT_DICTIONARY_PATH)
+        logger.info(f"Loaded product dictionary from {PRODUCT_DICTIONARY_PATH}")
+
+        if backfill:
+            scanned, written = backfill_mentions(conn, matcher)
+            logger.info(f"Mention backfill complete: {scanned} messages scanned, {written} mention rows written")
+            conn.close()
+            return
         
-        # Find all JSON files
+        # Find all data lake files (NDJSON and legacy JSON arrays)
         date_str = datetime.now().strftime('%Y-%m-%d')
-        json_files = BASE_DATA_PATH.glob(f"{date_str}/*.json")
+        json_files = sorted(f for pattern in LAKE_FILE_PATTERNS for f in BASE_DATA_PATH.glob(f"{date_str}/{pattern}"))
         
-        # Load each JSON file
-        for json_file in json_files:
-            logger.info(f"Processing file: {json_file}")
-            load_json_to_postgres(json_file, conn)
+        workers = min(LOAD_WORKERS, len(json_files))
+        if workers > 1:
+            # Load files in parallel, one connection per worker
+            logger.info(f"Loading {len(json_files)} files with {workers} workers")
+            results = load_files_parallel(json_files, workers)
+        else:
+            # Load each file sequentially on this connection
+            results = []
+            for json_file in json_files:
+                logger.info(f"Processing file: {json_file}")
+                results.append(load_json_to_postgres(json_file, conn, matcher))
+        log_load_summary(results)
         
         conn.close()
         logger.info("PostgreSQL connection closed")
@@ -134,4 +390,8 @@ def main():
         logger.error(f"Main error: {e}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load scraped messages from the data lake into PostgreSQL.")
+    parser.add_argument("--extract-mentions", action="store_true",
+                        help="Instead of loading files, re-extract product mentions for all messages already loaded.")
+    args = parser.parse_args()
+    main(backfill=args.extract_mentions)
\ No newline at end of file
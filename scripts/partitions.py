@@ -0,0 +1,280 @@
+"""
+Monthly range partitioning for the raw tables.
+
+raw.telegram_messages is partitioned by message_date and raw.image_detections by
+detection_timestamp, one partition per month (e.g. raw.telegram_messages_p202501).
+Writers call ensure_partitions before their transaction touches the table, so partitions
+are created on demand, and the pipeline creates upcoming months ahead of every run.
+This module also migrates existing unpartitioned tables and applies retention:
+
+    python scripts/partitions.py migrate
+    python scripts/partitions.py ensure --months-ahead 2
+    python scripts/partitions.py retention --keep-months 24 [--drop]
+
+Retention detaches partitions that lie entirely before the cutoff month. Detached
+partitions are moved to the `archive` schema, or dropped with --drop.
+"""
+import argparse
+import logging
+import time
+from datetime import date
+
+from psycopg2 import errors
+
+logger = logging.getLogger(__name__)
+
+# Partitioned table -> partition key column
+PARTITION_KEYS = {
+    'raw.telegram_messages': 'message_date',
+    'raw.image_detections': 'detection_timestamp',
+}
+
+ARCHIVE_SCHEMA = 'archive'
+
+# CREATE TABLE ... PARTITION OF needs an ACCESS EXCLUSIVE lock on the parent; wait at most this
+# long for it (instead of queueing every reader and writer behind us) and retry a few times
+PARTITION_LOCK_TIMEOUT_MS = 5000
+PARTITION_LOCK_RETRIES = 5
+
+# Partitions known to exist (committed), so writers skip the catalog lookup on later batches
+_known_partitions = set()
+_partitioned_tables = {}
+
+def month_start(value):
+    """First day of the month containing a date or datetime."""
+    return date(value.year, value.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+def is_partitioned(cur, table):
+    """True if the table exists and is range-partitioned (cached per process)."""
+    if table not in _partitioned_tables:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+        row = cur.fetchone()
+        if row is None:
+            return False # Not created yet; check again next time
+        _partitioned_tables[table] = row[0] == 'p'
+    return _partitioned_tables[table]
+
+def _create_partition(cur, table, month):
+    name = partition_name(table, month)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s);",
+                (month, add_months(month, 1)))
+    return name
+
+def create_partitions(conn, table, months):
+    """
+    Creates the monthly partitions of `table` covering `months` on `conn`, each in its own short
+    autocommit transaction. The parent's ACCESS EXCLUSIVE lock is therefore held only for the
+    CREATE itself; a statement that cannot get it within PARTITION_LOCK_TIMEOUT_MS is retried.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"SET lock_timeout = {PARTITION_LOCK_TIMEOUT_MS};")
+        for month in sorted({month_start(m) for m in months if m is not None}):
+            for attempt in range(1, PARTITION_LOCK_RETRIES + 1):
+                try:
+                    name = _create_partition(cur, table, month)
+                    break
+                except errors.LockNotAvailable:
+                    if attempt == PARTITION_LOCK_RETRIES:
+                        raise
+                    logger.warning(f"Timed out waiting to lock {table} for a new partition; retrying ({attempt}).")
+                    time.sleep(attempt)
+            _known_partitions.add(name)
+            logger.info(f"Ensured partition {name}.")
+
+def ensure_partitions(cur, table, months, connect):
+    """
+    Makes sure the monthly partitions of `table` covering `months` (dates or datetimes) exist.
+    Does nothing for tables that are not partitioned. Missing partitions are created through
+    create_partitions on a separate connection from `connect()`, never in the caller's
+    transaction, so call this before that transaction touches `table`: the CREATE waits for
+    every lock on the parent, including the caller's own.
+    """
+    if not is_partitioned(cur, table):
+        return
+    missing = []
+    for month in sorted({month_start(m) for m in months if m is not None}):
+        name = partition_name(table, month)
+        if name in _known_partitions:
+            continue
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+        if cur.fetchone()[0]:
+            _known_partitions.add(name)
+        else:
+            missing.append(month)
+    if missing:
+        conn = connect()
+        try:
+            create_partitions(conn, table, missing)
+        finally:
+            conn.close()
+
+def list_partitions(cur, table):
+    """Returns [(partition_name, month)] for the monthly partitions of a table, oldest first."""
+    cur.execute("""
+        SELECT n.nspname || '.' || c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.inhparent = to_regclass(%s);
+    """, (table,))
+    partitions = []
+    for (name,) in cur.fetchall():
+        suffix = name.rsplit('_p', 1)[-1]
+        if suffix.isdigit() and len(suffix) == 6:
+            partitions.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+def migrate_to_partitioned(conn, table, ddl):
+    """
+    Converts an existing unpartitioned table into a partitioned one in a single transaction:
+    the old table is renamed, `ddl` (the writer's CREATE TABLE ... PARTITION BY statement)
+    creates the new one, partitions are created for every month present and the rows are copied.
+    Rows with a NULL partition key cannot be placed; if any exist, the old table is kept.
+    Returns True if the table was migrated.
+    """
+    schema, name = table.split('.')
+    key = PARTITION_KEYS[table]
+    legacy = f"{name}_unpartitioned"
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+            row = cur.fetchone()
+            if row is None or row[0] != 'r':
+                return False
+
+            cur.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+            # Free the index names (including the primary key's) for the new table
+            cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = %s AND tablename = %s;", (schema, legacy))
+            for (index_name,) in cur.fetchall():
+                cur.execute(f'ALTER INDEX {schema}."{index_name}" RENAME TO "{index_name[:48]}_unpartitioned";')
+
+            cur.execute(ddl)
+            _partitioned_tables.pop(table, None)
+            cur.execute(f"SELECT DISTINCT date_trunc('month', {key})::DATE FROM {schema}.{legacy} WHERE {key} IS NOT NULL;")
+            # The new parent is only visible to this transaction, so its partitions are created here
+            for (month,) in cur.fetchall():
+                _create_partition(cur, table, month)
+
+            cur.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position;
+            """, (schema, legacy))
+            columns = ', '.join(column for (column,) in cur.fetchall())
+            cur.execute(f"""
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM {schema}.{legacy} WHERE {key} IS NOT NULL;
+            """)
+            migrated = cur.rowcount
+            cur.execute(f"SELECT COUNT(*) FROM {schema}.{legacy} WHERE {key} IS NULL;")
+            unplaced = cur.fetchone()[0]
+            if unplaced:
+                logger.warning(f"{unplaced} rows of {table} have no {key}; keeping them in {schema}.{legacy}.")
+            else:
+                cur.execute(f"DROP TABLE {schema}.{legacy};")
+        conn.commit()
+        logger.info(f"Migrated {migrated} rows of {table} into monthly partitions.")
+        return True
+    except Exception as e:
+        logger.error(f"Error partitioning {table}: {e}")
+        conn.rollback()
+        raise
+
+def apply_retention(conn, table, keep_months, drop=False, today=None):
+    """
+    Detaches the partitions of `table` that end before the first month to keep (the current
+    month and the keep_months - 1 before it), then moves them to ARCHIVE_SCHEMA or drops them.
+    Queries never scan detached months again. Returns the names of the detached partitions.
+    """
+    if keep_months < 1:
+        raise ValueError(f"keep_months must be at least 1 (the current month), got {keep_months}")
+    cutoff = add_months(month_start(today or date.today()), -(keep_months - 1))
+    detached = []
+    try:
+        with conn.cursor() as cur:
+            if not drop:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};")
+            for name, month in list_partitions(cur, table):
+                if month >= cutoff:
+                    break
+                cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+                if drop:
+                    cur.execute(f"DROP TABLE {name};")
+                else:
+                    cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA};")
+                _known_partitions.discard(name)
+                detached.append(name)
+        conn.commit()
+        action = 'Dropped' if drop else f'Archived to {ARCHIVE_SCHEMA}'
+        logger.info(f"{action}: {len(detached)} partitions of {table} before {cutoff}.")
+    except Exception as e:
+        logger.error(f"Error applying retention to {table}: {e}")
+        conn.rollback()
+        raise
+    return detached
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def main():
+    import psycopg2
+    from raw_schema import db_params, RAW_MESSAGES_DDL, DETECTIONS_DDL
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the raw tables.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("migrate", help="Convert existing unpartitioned raw tables to partitioned tables.")
+    ensure = subcommands.add_parser("ensure", help="Create partitions for the current and upcoming months.")
+    ensure.add_argument("--months-ahead", type=int, default=1)
+    retention = subcommands.add_parser("retention", help="Detach partitions older than --keep-months.")
+    retention.add_argument("--keep-months", type=positive_int, required=True,
+                           help="Months to keep, counting the current one.")
+    retention.add_argument("--drop", action="store_true", help="Drop detached partitions instead of archiving them.")
+    parser.add_argument("--table", choices=sorted(PARTITION_KEYS), help="Only manage this table.")
+    args = parser.parse_args()
+
+    tables = [args.table] if args.table else sorted(PARTITION_KEYS)
+    ddl = {'raw.telegram_messages': RAW_MESSAGES_DDL, 'raw.image_detections': DETECTIONS_DDL}
+    conn = psycopg2.connect(**db_params)
+    unpartitioned = []
+    try:
+        for table in tables:
+            if args.command == "migrate":
+                if not migrate_to_partitioned(conn, table, ddl[table]):
+                    logger.info(f"{table} is already partitioned (or does not exist).")
+            elif args.command == "ensure":
+                with conn.cursor() as cur:
+                    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+                    row = cur.fetchone()
+                conn.commit()
+                if row is None:
+                    logger.info(f"{table} does not exist yet; its writer creates it partitioned.")
+                    continue
+                if row[0] != 'p':
+                    # CREATE TABLE IF NOT EXISTS keeps a table created before partitioning as a plain heap
+                    logger.error(f"{table} is not partitioned; run `python scripts/partitions.py migrate` first.")
+                    unpartitioned.append(table)
+                    continue
+                this_month = month_start(date.today())
+                create_partitions(conn, table, [add_months(this_month, i) for i in range(args.months_ahead + 1)])
+                conn.autocommit = False
+            else:
+                apply_retention(conn, table, args.keep_months, args.drop)
+    finally:
+        conn.close()
+    if unpartitioned:
+        raise SystemExit(f"Not partitioned: {', '.join(unpartitioned)}. Run `python scripts/partitions.py migrate` first.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import csv
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+# Default product dictionary (product_name column, one keyword or phrase per row)
+DEFAULT_DICTIONARY_PATH = Path(__file__).parent / 'medical_keywords.csv'
+
+# \w is Unicode-aware, so Ethiopic (Amharic) letters form tokens while the Ethiopic
+# wordspace (፡) and full stop (።) act as separators, just like spaces and punctuation.
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def normalize(text):
+    """Unicode-normalizes and case-folds text so matching is case- and encoding-insensitive."""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+def tokenize(text):
+    """Splits normalized text into word tokens."""
+    return TOKEN_PATTERN.findall(normalize(text))
+
+def load_dictionary(path=DEFAULT_DICTIONARY_PATH):
+    """Reads product keywords from a CSV file with a `product_name` column."""
+    with Path(path).open('r', encoding='utf-8', newline='') as f:
+        return [row['product_name'].strip() for row in csv.DictReader(f) if row['product_name'].strip()]
+
+class ProductMatcher:
+    """
+    Single-pass multi-keyword matcher for product mentions.
+
+    Keywords (single words or phrases) are compiled once into a trie keyed by token.
+    Matching walks the message's tokens once, following the trie from each position,
+    so the cost per message is O(tokens x longest phrase) regardless of dictionary size.
+    Matches always fall on word boundaries: 'gel' never matches inside 'angel'.
+    """
+
+    _END = object() # Trie marker holding the canonical product name
+
+    def __init__(self, keywords):
+        self._trie = {}
+        self.max_phrase_length = 0
+        for keyword in keywords:
+            tokens = tokenize(keyword)
+            if not tokens:
+                continue
+            node = self._trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node[self._END] = ' '.join(tokens)
+            self.max_phrase_length = max(self.max_phrase_length, len(tokens))
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_DICTIONARY_PATH):
+        """Builds a matcher from a product dictionary CSV."""
+        return cls(load_dictionary(path))
+
+    def find_all(self, text):
+        """Returns every product mention in `text`, in order of appearance (overlaps included)."""
+        if not text:
+            return []
+        tokens = tokenize(text)
+        matches = []
+        trie = self._trie
+        for start in range(len(tokens)):
+            node = trie.get(tokens[start])
+            offset = start + 1
+            while node is not None:
+                product = node.get(self._END)
+                if product is not None:
+                    matches.append(product)
+                if offset >= len(tokens):
+                    break
+                node = node.get(tokens[offset])
+                offset += 1
+        return matches
+
+    def count(self, text):
+        """Returns a Counter of product name -> number of mentions in `text`."""
+        return Counter(self.find_all(text))
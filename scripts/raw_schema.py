@@ -0,0 +1,97 @@
+"""
+Connection settings and table definitions of the raw schema, shared by the loader, the YOLO
+script and partitions.py. Kept free of heavy imports (and of logging setup), so tools that
+only manage the tables do not load OpenCV or the YOLO model, or redirect their own logging.
+"""
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=Path(__file__).parent.parent / '.env')
+db_params = {
+    'dbname': os.getenv('POSTGRES_DB'),
+    'user': os.getenv('POSTGRES_USER'),
+    'password': os.getenv('POSTGRES_PASSWORD'),
+    'host': os.getenv('POSTGRES_HOST'),
+    'port': os.getenv('POSTGRES_PORT')
+}
+
+# Partitioned by month of message_date (see partitions.py); a message's date never changes,
+# so the primary key still identifies one message per channel.
+RAW_MESSAGES_DDL = """
+    CREATE SCHEMA IF NOT EXISTS raw;
+    CREATE TABLE IF NOT EXISTS raw.telegram_messages (
+        message_id BIGINT,
+        channel_name VARCHAR(255),
+        channel_username VARCHAR(255),
+        scrape_date DATE,
+        message_date DATE NOT NULL,
+        message_text TEXT,
+        message_length INTEGER,
+        views INTEGER,
+        forwards INTEGER,
+        has_photo BOOLEAN,
+        photo_path TEXT,
+        PRIMARY KEY (message_id, channel_username, message_date)
+    ) PARTITION BY RANGE (message_date);
+    -- Lets incremental dbt models select only newly scraped messages
+    CREATE INDEX IF NOT EXISTS idx_telegram_messages_scrape_date
+        ON raw.telegram_messages (scrape_date);
+    -- Per-channel activity over a date range; point lookups by (message_id, channel_username) use the primary key
+    CREATE INDEX IF NOT EXISTS idx_telegram_messages_channel_date
+        ON raw.telegram_messages (channel_username, message_date);
+"""
+
+# raw.image_detections is partitioned by month of detection_timestamp (see partitions.py), so
+# detection_id is unique per partition only; writers delete before inserting to keep it unique.
+DETECTIONS_DDL = """
+    CREATE SCHEMA IF NOT EXISTS raw;
+    CREATE TABLE IF NOT EXISTS raw.image_detections (
+        detection_id VARCHAR(255) NOT NULL,
+        message_id BIGINT,
+        channel_username VARCHAR(255),
+        image_path TEXT,
+        detected_object_class VARCHAR(255),
+        confidence_score NUMERIC(5, 4),
+        detection_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (detection_id, detection_timestamp)
+    ) PARTITION BY RANGE (detection_timestamp);
+    ALTER TABLE raw.image_detections
+        ADD COLUMN IF NOT EXISTS box_index SMALLINT,
+        ADD COLUMN IF NOT EXISTS box_x1 REAL,
+        ADD COLUMN IF NOT EXISTS box_y1 REAL,
+        ADD COLUMN IF NOT EXISTS box_x2 REAL,
+        ADD COLUMN IF NOT EXISTS box_y2 REAL,
+        ADD COLUMN IF NOT EXISTS image_width INTEGER,
+        ADD COLUMN IF NOT EXISTS image_height INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_image_detections_detection_id
+        ON raw.image_detections (detection_id);
+    CREATE INDEX IF NOT EXISTS idx_image_detections_message
+        ON raw.image_detections (message_id, channel_username);
+    -- Lets the incremental fct_image_detections select only new detections
+    CREATE INDEX IF NOT EXISTS idx_image_detections_timestamp
+        ON raw.image_detections (detection_timestamp);
+
+    -- class_max_confidence answers e.g. "images with a bottle at conf > 0.8" through its GIN index:
+    --   WHERE class_max_confidence ? 'bottle' AND (class_max_confidence->>'bottle')::REAL > 0.8
+    CREATE TABLE IF NOT EXISTS raw.image_summaries (
+        content_hash CHAR(64) NOT NULL,
+        model_version VARCHAR(64) NOT NULL,
+        image_path TEXT NOT NULL,
+        image_width INTEGER,
+        image_height INTEGER,
+        detection_count INTEGER NOT NULL,
+        class_counts JSONB NOT NULL,
+        class_max_confidence JSONB NOT NULL,
+        max_confidence REAL,
+        inference_ms REAL,
+        processed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (content_hash, model_version)
+    );
+    CREATE INDEX IF NOT EXISTS idx_image_summaries_classes
+        ON raw.image_summaries USING GIN (class_max_confidence);
+    CREATE INDEX IF NOT EXISTS idx_image_summaries_max_confidence
+        ON raw.image_summaries (max_confidence);
+"""
@@ -1,6 +1,8 @@
 import os
 import json
 import logging
+import argparse
+import time
 from datetime import datetime
 from pathlib import Path
 from telethon import TelegramClient
@@ -9,6 +11,9 @@ from telethon.errors import FloodWaitError, SessionPasswordNeededError
 from dotenv import load_dotenv
 import asyncio
 
+from data_lake import NDJSONWriter, lake_filename
+from image_store import ImageStore
+
 # --- LOGGING SETUP ---
 LOG_DIR = Path('logs/') 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -37,8 +42,251 @@ TARGET_CHANNELS = {
 BASE_DATA_PATH = Path('data/raw/telegram_messages')
 IMAGE_PATH = Path('data/images') # For image collection
 
-async def scrape_channel(client, channel_username, date_str):
-    """Scrape messages and photos from a Telegram channel and save to data lake."""
+# Per-channel scrape state (high-water mark and backfill position)
+SCRAPER_STATE_PATH = Path(os.getenv('SCRAPER_STATE_PATH', 'data/raw/scraper_state.json'))
+# Messages fetched on the very first run of a channel, before any watermark exists
+SCRAPE_INITIAL_LIMIT = int(os.getenv('SCRAPE_INITIAL_LIMIT', '100'))
+# Messages per backfill chunk; state is saved after every chunk so backfills can resume
+BACKFILL_CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', '1000'))
+
+# Scheduler settings: channels scraped at once, global API request budget, longest FloodWait to sit out
+SCRAPE_CONCURRENCY = int(os.getenv('SCRAPE_CONCURRENCY', '3'))
+SCRAPE_REQUESTS_PER_SECOND = float(os.getenv('SCRAPE_REQUESTS_PER_SECOND', '5'))
+FLOOD_WAIT_MAX_SECONDS = int(os.getenv('FLOOD_WAIT_MAX_SECONDS', '3600'))
+# Concurrent photo downloads per channel, and how many photos may wait in the download queue
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', '32'))
+# Telethon fetches history in pages of this many messages (one API request each)
+MESSAGES_PER_REQUEST = 100
+
+class RateLimiter:
+    """Token bucket shared by all channel tasks so the whole scraper stays within one request budget."""
+
+    def __init__(self, rate=SCRAPE_REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be made."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class ChannelStats:
+    """Per-channel counters for the end-of-run throughput report."""
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.messages = 0
+        self.images = 0
+        self.images_skipped = 0
+        self.images_deduplicated = 0
+        self.image_bytes = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        elapsed = self.elapsed or 1e-9
+        return (f"{self.channel_name}: {self.messages} messages, {self.images} images "
+                f"({self.images_skipped} already stored, {self.images_deduplicated} duplicates, {self.image_bytes / 1e6:.1f} MB) in {elapsed:.1f}s - "
+                f"{self.messages / elapsed:.1f} msg/s, {self.images / elapsed:.1f} images/s, "
+                f"{self.image_bytes / elapsed / 1e6:.2f} MB/s, {self.flood_waits} flood waits ({self.flood_wait_seconds}s)")
+
+async def sleep_for_flood_wait(error, channel_name, stats):
+    """Sit out a FloodWaitError, or re-raise it if the server asks for longer than FLOOD_WAIT_MAX_SECONDS."""
+    if error.seconds > FLOOD_WAIT_MAX_SECONDS:
+        raise error
+    stats.flood_waits += 1
+    stats.flood_wait_seconds += error.seconds
+    logger.warning(f"Rate limit hit for {channel_name}: sleeping {error.seconds} seconds, then resuming")
+    await asyncio.sleep(error.seconds)
+
+async def call_with_flood_wait(limiter, stats, channel_name, func, *args, **kwargs):
+    """Make one rate-limited API call, retrying after any FloodWait the server imposes."""
+    while True:
+        await limiter.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            await sleep_for_flood_wait(e, channel_name, stats)
+
+async def iter_messages_resumable(client, entity, limiter, stats, channel_name, limit=None, **kwargs):
+    """
+    Wrap client.iter_messages under the rate budget. On FloodWaitError, sleep for the
+    server-specified time and restart iteration just past the last yielded message,
+    so no message is skipped or yielded twice.
+    """
+    reverse = kwargs.get('reverse', False)
+    yielded = 0
+    while True:
+        await limiter.acquire()
+        try:
+            async for message in client.iter_messages(entity, limit=None if limit is None else limit - yielded, **kwargs):
+                yielded += 1
+                if yielded % MESSAGES_PER_REQUEST == 0:
+                    await limiter.acquire() # Next page is another API request
+                # Resume position: newer than this id when ascending, older than it when descending
+                kwargs['min_id' if reverse else 'offset_id'] = message.id
+                yield message
+            return
+        except FloodWaitError as e:
+            await sleep_for_flood_wait(e, channel_name, stats)
+
+def load_state(path=SCRAPER_STATE_PATH):
+    """Load per-channel scrape state: {channel_username: {last_message_id, oldest_message_id, ...}}."""
+    if not path.exists():
+        return {}
+    with path.open('r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state, path=SCRAPER_STATE_PATH):
+    """Persist scrape state atomically (write a temp file, then rename over the old one)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def new_output_file(directory, stem):
+    """Return a lake file path for `stem` that does not overwrite an earlier run's file."""
+    output_file = directory / lake_filename(stem)
+    if output_file.exists():
+        output_file = directory / lake_filename(f"{stem}_{datetime.now().strftime('%H%M%S')}")
+    return output_file
+
+def build_message_record(message, channel_name):
+    """Convert a Telethon message into a lake record (photo_path is filled in once the photo is downloaded)."""
+    return {
+        'message_id': message.id,
+        'channel': channel_name, # Use the internal name for consistency
+        'date': message.date.isoformat().split("T")[0], # in yyyy-mm-dd format only
+        'text': message.text or '',
+        'views': message.views if message.views is not None else 0,
+        'forwards': message.forwards if message.forwards is not None else 0,
+        'has_photo': bool(message.photo),
+        'photo_path': None
+    }
+
+class PhotoDownloader:
+    """
+    Bounded queue of photo downloads served by `workers` concurrent tasks, fed by the
+    message iterator so paging never waits on an image transfer. A message with a photo
+    is written to the lake once its download finishes (with photo_path set on success).
+    Photos are downloaded to a temporary file and handed to the content-addressed
+    ImageStore; photos already stored for a message are not downloaded again.
+    """
+
+    def __init__(self, client, channel_name, writer, limiter, stats, store,
+                 workers=DOWNLOAD_WORKERS, queue_size=DOWNLOAD_QUEUE_SIZE):
+        self.client = client
+        self.channel_name = channel_name
+        self.writer = writer
+        self.limiter = limiter
+        self.stats = stats
+        self.store = store
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def submit(self, message, record):
+        """Queue a photo download; waits while the queue is full (backpressure on paging)."""
+        await self._queue.put((message, record))
+
+    async def _worker(self):
+        while True:
+            message, record = await self._queue.get()
+            try:
+                await self._download(message, record)
+            finally:
+                self._queue.task_done()
+
+    async def _download(self, message, record):
+        # Photos scraped before the content-addressed store keep their original path
+        legacy_path = IMAGE_PATH / f"{self.channel_name}_{message.id}.jpg"
+        tmp_path = IMAGE_PATH / f"{self.channel_name}_{message.id}.jpg.part"
+        try:
+            entry = self.store.lookup(self.channel_name, message.id)
+            if entry is not None or legacy_path.exists():
+                self.stats.images_skipped += 1
+                photo_path = entry['image_path'] if entry is not None else str(legacy_path)
+            else:
+                await call_with_flood_wait(self.limiter, self.stats, self.channel_name,
+                                           self.client.download_media, message.media, file=tmp_path)
+                self.stats.image_bytes += tmp_path.stat().st_size
+                entry = self.store.put(self.channel_name, message.id, tmp_path)
+                photo_path = entry['image_path']
+                if entry['duplicate']:
+                    self.stats.images_deduplicated += 1
+                else:
+                    self.stats.images += 1
+                logger.info(f"Downloaded photo for message {message.id} from {self.channel_name} to {photo_path}"
+                            f"{' (duplicate)' if entry['duplicate'] else ''}")
+            record['photo_path'] = photo_path # Relative to the project root
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.error(f"Failed to download photo for message {message.id} from {self.channel_name}: {e}")
+        self.writer.write(record)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._queue.join() # Let queued downloads finish before the lake file is closed
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+async def write_messages(client, messages, channel_name, writer, limiter, stats, store):
+    """
+    Stream messages into the lake writer, handing photos to a PhotoDownloader for the
+    channels that collect images. Returns the (newest, oldest) message ids seen.
+    """
+    download_images = channel_name in ['Chemed', 'Lobelia4Cosmetics']
+    newest_id = oldest_id = None
+    async with PhotoDownloader(client, channel_name, writer, limiter, stats, store) as downloader:
+        async for message in messages:
+            record = build_message_record(message, channel_name)
+            # Handle photos only for specified channels
+            if download_images and isinstance(message.media, MessageMediaPhoto):
+                await downloader.submit(message, record)
+            else:
+                writer.write(record)
+            stats.messages += 1
+            newest_id = message.id if newest_id is None else max(newest_id, message.id)
+            oldest_id = message.id if oldest_id is None else min(oldest_id, message.id)
+    return newest_id, oldest_id
+
+def prepare_directories(date_str):
+    """Ensure the raw JSON directory for date_str and the image directory exist."""
+    channel_json_path = BASE_DATA_PATH / date_str
+    channel_json_path.mkdir(parents=True, exist_ok=True)
+    IMAGE_PATH.mkdir(parents=True, exist_ok=True) # This will create 'data/images'
+    return channel_json_path
+
+async def scrape_channel(client, channel_username, date_str, state, limiter, stats, store):
+    """
+    Scrape messages newer than the channel's high-water mark and save them to the data lake.
+    The first run of a channel fetches the latest SCRAPE_INITIAL_LIMIT messages; older
+    history is left to backfill_channel.
+    """
     channel_name = TARGET_CHANNELS.get(channel_username)
     if not channel_name:
         logger.error(f"Unknown channel username: {channel_username}. Skipping.")
@@ -46,58 +294,123 @@ async def scrape_channel(client, channel_username, date_str):
 
     try:
         # Get channel entity
-        entity = await client.get_entity(channel_username)
-        logger.info(f"Scraping channel: {channel_username} (Internal name: {channel_name})")
-
-        # Ensure directory exists for raw JSON
-        channel_json_path = BASE_DATA_PATH / date_str
-        channel_json_path.mkdir(parents=True, exist_ok=True)
-        
-        # Ensure image directory exists
-        IMAGE_PATH.mkdir(parents=True, exist_ok=True) # This will create 'data/images'
-
-        messages_data = []
-        download_images = channel_name in ['Chemed', 'Lobelia4Cosmetics']
-
-        async for message in client.iter_messages(entity, limit=100): # Scrape exactly 100 messages
-            message_data = {
-                'message_id': message.id,
-                'channel': channel_name, # Use the internal name for consistency
-                'date': message.date.isoformat().split("T")[0], # in yyyy-mm-dd format only
-                'text': message.text or '',
-                'views': message.views if message.views is not None else 0,
-                'forwards': message.forwards if message.forwards is not None else 0,
-                'has_photo': bool(message.photo),
-                'photo_path': None
-            }
+        entity = await call_with_flood_wait(limiter, stats, channel_name, client.get_entity, channel_username)
+        channel_state = state.setdefault(channel_username, {})
+        last_message_id = channel_state.get('last_message_id')
+        logger.info(f"Scraping channel: {channel_username} (Internal name: {channel_name}), after message {last_message_id}")
 
-            # Handle photos only for specified channels
-            if download_images and isinstance(message.media, MessageMediaPhoto):
-                try:
-                    # Ensure path is relative to the project root for consistency in the JSON
-                    photo_filename = f"{channel_name}_{message.id}.jpg"
-                    full_photo_path = IMAGE_PATH / photo_filename
-                    await client.download_media(message.media, file=full_photo_path)
-                    message_data['photo_path'] = str(full_photo_path.relative_to(Path('.'))) # Store relative path
-                    logger.info(f"Downloaded photo for message {message.id} from {channel_name} to {full_photo_path}")
-                except Exception as e:
-                    logger.error(f"Failed to download photo for message {message.id} from {channel_name}: {e}")
-
-            messages_data.append(message_data)
-
-        # Save messages as JSON
-        output_file = channel_json_path / f"{channel_name}.json"
-        with output_file.open('w', encoding='utf-8') as f:
-            json.dump(messages_data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(messages_data)} messages from {channel_name} to {output_file}")
+        channel_json_path = prepare_directories(date_str)
+
+        if last_message_id is None:
+            messages = iter_messages_resumable(client, entity, limiter, stats, channel_name, limit=SCRAPE_INITIAL_LIMIT)
+        else:
+            # Only messages newer than the watermark, oldest first
+            messages = iter_messages_resumable(client, entity, limiter, stats, channel_name, min_id=last_message_id, reverse=True)
+
+        # Messages are streamed to newline-delimited JSON as they are scraped, so memory stays flat
+        output_file = new_output_file(channel_json_path, channel_name)
+        with NDJSONWriter(output_file) as writer:
+            newest_id, oldest_id = await write_messages(client, messages, channel_name, writer, limiter, stats, store)
+
+        if newest_id is None:
+            output_file.unlink(missing_ok=True)
+            logger.info(f"No new messages for {channel_name} since message {last_message_id}")
+            return
+
+        # Advance the watermark only once the lake file is safely written
+        channel_state['last_message_id'] = newest_id
+        channel_state.setdefault('oldest_message_id', oldest_id)
+        save_state(state)
+        logger.info(f"Saved {writer.count} messages from {channel_name} to {output_file}")
 
     except FloodWaitError as e:
-        logger.error(f"Rate limit hit for {channel_username}: wait {e.seconds} seconds")
+        logger.error(f"Rate limit for {channel_username} exceeds {FLOOD_WAIT_MAX_SECONDS}s (wait {e.seconds} seconds); giving up this run")
     except Exception as e:
         logger.error(f"Error scraping {channel_username}: {e}")
 
-async def main():
-    """Main function to scrape all specified channels."""
+async def backfill_channel(client, channel_username, date_str, state, limiter, stats, store, chunk_size=BACKFILL_CHUNK_SIZE, max_chunks=None):
+    """
+    Page backwards through a channel's history in chunks of chunk_size messages, starting
+    below the oldest message scraped so far. Each chunk is written to its own lake file and
+    the position is saved after every chunk, so an interrupted backfill resumes where it stopped.
+    """
+    channel_name = TARGET_CHANNELS.get(channel_username)
+    if not channel_name:
+        logger.error(f"Unknown channel username: {channel_username}. Skipping.")
+        return
+
+    channel_state = state.setdefault(channel_username, {})
+    if channel_state.get('backfill_complete'):
+        logger.info(f"Backfill already complete for {channel_name}")
+        return
+
+    try:
+        entity = await call_with_flood_wait(limiter, stats, channel_name, client.get_entity, channel_username)
+        channel_json_path = prepare_directories(date_str)
+
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            # offset_id=0 starts from the newest message; otherwise fetch messages older than it
+            offset_id = channel_state.get('oldest_message_id') or 0
+            output_file = new_output_file(channel_json_path, f"{channel_name}_backfill_{offset_id}")
+            messages = iter_messages_resumable(client, entity, limiter, stats, channel_name,
+                                               offset_id=offset_id, limit=chunk_size)
+            with NDJSONWriter(output_file) as writer:
+                newest_id, oldest_id = await write_messages(client, messages, channel_name, writer, limiter, stats, store)
+
+            if oldest_id is not None:
+                channel_state['oldest_message_id'] = oldest_id
+                channel_state.setdefault('last_message_id', newest_id)
+                logger.info(f"Backfilled {writer.count} messages from {channel_name} (ids {oldest_id}-{newest_id}) to {output_file}")
+            else:
+                output_file.unlink(missing_ok=True)
+            if writer.count < chunk_size:
+                # Reached the start of the channel
+                channel_state['backfill_complete'] = True
+                save_state(state)
+                logger.info(f"Backfill complete for {channel_name}")
+                return
+            save_state(state)
+            chunks += 1
+
+    except FloodWaitError as e:
+        logger.error(f"Rate limit while backfilling {channel_username} exceeds {FLOOD_WAIT_MAX_SECONDS}s (wait {e.seconds} seconds); rerun to resume")
+    except Exception as e:
+        logger.error(f"Error backfilling {channel_username}: {e}")
+
+async def scrape_all_channels(client, date_str, backfill=False, chunk_size=BACKFILL_CHUNK_SIZE, max_chunks=None,
+                              concurrency=SCRAPE_CONCURRENCY, limiter=None):
+    """
+    Scrape every target channel concurrently (at most `concurrency` at a time) under one
+    shared request budget, then log per-channel throughput. `client` only needs
+    get_entity, iter_messages and download_media, so a stand-in client can drive it.
+    """
+    state = load_state()
+    limiter = limiter or RateLimiter()
+    store = ImageStore()
+    semaphore = asyncio.Semaphore(concurrency)
+    all_stats = []
+
+    async def run_channel(channel_username):
+        channel_name = TARGET_CHANNELS[channel_username]
+        async with semaphore:
+            stats = ChannelStats(channel_name)
+            all_stats.append(stats)
+            logger.info(f"Starting {'backfill' if backfill else 'scrape'} for channel: {channel_name}")
+            if backfill:
+                await backfill_channel(client, channel_username, date_str, state, limiter, stats, store, chunk_size, max_chunks)
+            else:
+                await scrape_channel(client, channel_username, date_str, state, limiter, stats, store)
+            stats.finish()
+            logger.info(f"Completed {'backfill' if backfill else 'scrape'} for channel: {channel_name}")
+
+    await asyncio.gather(*(run_channel(channel_username) for channel_username in TARGET_CHANNELS))
+    for stats in all_stats:
+        logger.info(f"Throughput - {stats.summary()}")
+    return all_stats
+
+async def main(backfill=False, chunk_size=BACKFILL_CHUNK_SIZE, max_chunks=None):
+    """Main function to scrape all specified channels (new messages, or history when backfilling)."""
 
     # Initialize Telegram client
     async with TelegramClient('telegram_medical_session', api_id, api_hash) as client:
@@ -117,14 +430,16 @@ async def main():
             # Get current date for directory structure
             date_str = datetime.now().strftime('%Y-%m-%d')
 
-            # Scrape each channel
-            for channel_username in TARGET_CHANNELS.keys(): # Iterate over keys
-                logger.info(f"Starting scrape for channel: {TARGET_CHANNELS[channel_username]}")
-                await scrape_channel(client, channel_username, date_str)
-                logger.info(f"Completed scrape for channel: {TARGET_CHANNELS[channel_username]}")
+            # Scrape all channels concurrently
+            await scrape_all_channels(client, date_str, backfill, chunk_size, max_chunks)
 
         except Exception as e:
             logger.error(f"Client error during authentication or main loop: {e}")
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape Telegram channels into the data lake.")
+    parser.add_argument('--backfill', action='store_true', help="Page through older history instead of fetching new messages")
+    parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE, help="Messages per backfill chunk")
+    parser.add_argument('--max-chunks', type=int, default=None, help="Stop each channel's backfill after this many chunks")
+    args = parser.parse_args()
+    asyncio.run(main(backfill=args.backfill, chunk_size=args.chunk_size, max_chunks=args.max_chunks))
\ No newline at end of file
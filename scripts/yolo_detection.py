@@ -1,12 +1,25 @@
 import os
+import time
+import argparse
+import json
 import logging
+import shutil
+from collections import Counter, deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from multiprocessing import util as mp_util
 from pathlib import Path
 from datetime import datetime
+import cv2
 import psycopg2
 from psycopg2.extras import execute_batch
-from dotenv import load_dotenv
 from ultralytics import YOLO
 
+from data_lake import iter_batches
+from image_store import IMAGE_STORE_PATH, IMAGE_MANIFEST_PATH, file_sha256, read_manifest_since
+from partitions import ensure_partitions
+from raw_schema import db_params, DETECTIONS_DDL
+
 # Configure logging
 LOG_DIR = Path('logs')
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -20,16 +33,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv(dotenv_path=Path(__file__).parent.parent / '.env')
-db_params = {
-    'dbname': os.getenv('POSTGRES_DB'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD'),
-    'host': os.getenv('POSTGRES_HOST'),
-    'port': os.getenv('POSTGRES_PORT')
-}
-
 # Channel name to username mapping
 CHANNEL_USERNAME_MAP = {
     'Chemed': '@CheMed123',
@@ -41,6 +44,42 @@ CHANNEL_USERNAME_MAP = {
 IMAGE_DIR = Path('data/images')
 YOLO_MODEL_PATH = 'yolov8n.pt'
 
+# Inference backend: 'torch' (the .pt weights), 'onnx' (ONNX Runtime) or 'openvino'
+YOLO_BACKEND = os.getenv('YOLO_BACKEND', 'torch').lower()
+# Quantize the exported model to INT8 (onnx: dynamic quantization, openvino: calibrated on YOLO_INT8_DATA)
+YOLO_INT8 = os.getenv('YOLO_INT8', 'false').lower() == 'true'
+YOLO_INT8_DATA = os.getenv('YOLO_INT8_DATA', 'coco8.yaml')
+# Exported models are kept here and reused by later runs instead of being exported again
+YOLO_MODEL_CACHE_DIR = Path(os.getenv('YOLO_MODEL_CACHE_DIR', 'models'))
+
+def default_model_version(backend=YOLO_BACKEND, int8=YOLO_INT8):
+    """e.g. 'yolov8n', 'yolov8n-onnx' or 'yolov8n-openvino-int8'."""
+    version = Path(YOLO_MODEL_PATH).stem
+    if backend != 'torch':
+        version += f"-{backend}"
+    if int8 and backend != 'torch':
+        version += "-int8"
+    return version
+
+# Recorded in raw.processed_images so results from different models can be told apart
+YOLO_MODEL_VERSION = os.getenv('YOLO_MODEL_VERSION', default_model_version())
+
+# Batched inference: images per model call, and threads decoding images ahead of the model
+YOLO_BATCH_SIZE = int(os.getenv('YOLO_BATCH_SIZE', '16'))
+YOLO_DECODE_WORKERS = int(os.getenv('YOLO_DECODE_WORKERS', '4'))
+
+# Sharded execution: worker processes (each loads the model once) and images per shard task
+YOLO_WORKERS = int(os.getenv('YOLO_WORKERS', '1'))
+YOLO_SHARD_SIZE = int(os.getenv('YOLO_SHARD_SIZE', '256'))
+
+# Checkpointing: commit detections every N images or T seconds, whichever comes first
+YOLO_COMMIT_EVERY = int(os.getenv('YOLO_COMMIT_EVERY', '100'))
+YOLO_COMMIT_SECONDS = float(os.getenv('YOLO_COMMIT_SECONDS', '30'))
+
+# 'replace': a processed image's detections replace whatever its message had before (e.g. from an
+# older model version); 'upsert': rows with the same detection_id are updated, others are kept
+YOLO_WRITE_MODE = os.getenv('YOLO_WRITE_MODE', 'replace').lower()
+
 def get_db_connection():
     """Establishes and returns a database connection."""
     try:
@@ -52,21 +91,14 @@ def get_db_connection():
         raise
 
 def create_detection_table(conn):
-    """Creates the raw.image_detections table if it doesn't exist."""
+    """
+    Creates the raw.image_detections table (one row per box, with its coordinates in pixels and
+    the image size) and raw.image_summaries (one row per distinct image and model version) if
+    they don't exist. Box and size columns are added to tables created before they existed.
+    """
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-                CREATE SCHEMA IF NOT EXISTS raw;
-                CREATE TABLE IF NOT EXISTS raw.image_detections (
-                    detection_id VARCHAR(255) PRIMARY KEY,
-                    message_id BIGINT,
-                    channel_username VARCHAR(255),
-                    image_path TEXT,
-                    detected_object_class VARCHAR(255),
-                    confidence_score NUMERIC(5, 4),
-                    detection_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+            cur.execute(DETECTIONS_DDL)
         conn.commit()
         logger.info("Created raw.image_detections table successfully.")
     except Exception as e:
@@ -74,119 +106,652 @@ def create_detection_table(conn):
         conn.rollback()
         raise
 
-def get_processed_images(conn):
-    """Retrieves a set of image paths that have already been processed."""
-    processed_images = set()
+def create_ledger_tables(conn):
+    """
+    Creates raw.processed_images, the ledger with one row per processed message image
+    (including images with no detections and images that failed), and
+    raw.image_enrichment_watermarks, which records how far discovery has scanned.
+    A newly created ledger is seeded from the messages already in raw.image_detections.
+    """
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT image_path FROM raw.image_detections;")
-            for row in cur.fetchall():
-                processed_images.add(row[0])
-        logger.info(f"Found {len(processed_images)} images already processed.")
+            cur.execute("SELECT to_regclass('raw.processed_images') IS NULL;")
+            is_new = cur.fetchone()[0]
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS raw.processed_images (
+                    message_id BIGINT NOT NULL,
+                    channel_username VARCHAR(255) NOT NULL,
+                    image_path TEXT NOT NULL,
+                    content_hash CHAR(64),
+                    model_version VARCHAR(64) NOT NULL,
+                    status VARCHAR(16) NOT NULL,
+                    detection_count INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    processed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (message_id, channel_username)
+                );
+                CREATE INDEX IF NOT EXISTS idx_processed_images_image_path
+                    ON raw.processed_images (image_path) WHERE status = 'done';
+                CREATE INDEX IF NOT EXISTS idx_processed_images_content_hash
+                    ON raw.processed_images (content_hash, model_version);
+                CREATE INDEX IF NOT EXISTS idx_processed_images_failed
+                    ON raw.processed_images (processed_at) WHERE status = 'failed';
+                -- Lets fct_image_detections (dbt) find the images processed since its last run
+                CREATE INDEX IF NOT EXISTS idx_processed_images_processed_at
+                    ON raw.processed_images (processed_at);
+                CREATE TABLE IF NOT EXISTS raw.image_enrichment_watermarks (
+                    source VARCHAR(64) PRIMARY KEY,
+                    position DOUBLE PRECISION NOT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            if is_new:
+                cur.execute("""
+                    INSERT INTO raw.processed_images (
+                        message_id, channel_username, image_path, model_version, status, detection_count, processed_at
+                    )
+                    SELECT message_id, channel_username, MIN(image_path), %s, 'done', COUNT(*), MAX(detection_timestamp)
+                    FROM raw.image_detections
+                    GROUP BY message_id, channel_username
+                    ON CONFLICT DO NOTHING;
+                """, (default_model_version('torch', False),)) # Detections so far came from the .pt weights
+                logger.info(f"Seeded raw.processed_images with {cur.rowcount} previously processed messages.")
+        conn.commit()
     except Exception as e:
-        logger.error(f"Error retrieving processed images: {e}")
-    return processed_images
+        logger.error(f"Error creating processed-images ledger: {e}")
+        conn.rollback()
+        raise
 
-def main():
-    """Run YOLO object detection and store results in the database."""
-    logger.info("Starting YOLO object detection process...")
-    
-    # Load YOLO model
+def get_watermarks(conn):
+    """Returns {source: position} for the discovery watermarks."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT source, position FROM raw.image_enrichment_watermarks;")
+        return dict(cur.fetchall())
+
+def save_watermarks(conn, watermarks):
+    """Advances the discovery watermarks and commits."""
+    with conn.cursor() as cur:
+        execute_batch(cur, """
+            INSERT INTO raw.image_enrichment_watermarks (source, position, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET position = EXCLUDED.position, updated_at = EXCLUDED.updated_at
+        """, list(watermarks.items()))
+    conn.commit()
+
+def filter_unprocessed(conn, candidates, batch_size=1000):
+    """
+    Drops the candidates ({(message_id, channel_username): ...}) the ledger already records as done.
+    Only the candidates are looked up, in batches against the ledger's primary key.
+    """
+    done = set()
+    with conn.cursor() as cur:
+        for batch in iter_batches(candidates, batch_size):
+            cur.execute("""
+                SELECT p.message_id, p.channel_username
+                FROM raw.processed_images p
+                JOIN unnest(%s::BIGINT[], %s::TEXT[]) AS c(message_id, channel_username)
+                  ON p.message_id = c.message_id AND p.channel_username = c.channel_username
+                WHERE p.status = 'done';
+            """, ([key[0] for key in batch], [key[1] for key in batch]))
+            done.update(cur.fetchall())
+    return {key: value for key, value in candidates.items() if key not in done}
+
+def get_images_to_retry(conn, reprocess_outdated=False):
+    """
+    Returns {(message_id, channel_username): image_path} for images whose last attempt failed and,
+    with reprocess_outdated, images processed with a model version other than YOLO_MODEL_VERSION.
+    """
+    with conn.cursor() as cur:
+        if reprocess_outdated:
+            cur.execute("""
+                SELECT message_id, channel_username, image_path FROM raw.processed_images
+                WHERE status = 'failed' OR model_version <> %s;
+            """, (YOLO_MODEL_VERSION,))
+        else:
+            cur.execute("SELECT message_id, channel_username, image_path FROM raw.processed_images WHERE status = 'failed';")
+        return {(message_id, channel_username): image_path for message_id, channel_username, image_path in cur.fetchall()}
+
+def get_cached_detections(conn, image_paths):
+    """
+    Returns {image_path: analysis} (see run_batched_inference) for images that were already
+    run through the current model version for some other message, so reposted photos are not
+    inferred again. Images processed with no detections have an empty detection list.
+    """
+    cached = {}
+    if not image_paths:
+        return cached
     try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH sources AS (
+                    -- Copy the detections of a single referencing message per image
+                    SELECT DISTINCT ON (image_path) image_path, message_id, channel_username
+                    FROM raw.processed_images
+                    WHERE image_path = ANY(%s) AND status = 'done' AND model_version = %s
+                    ORDER BY image_path, message_id, channel_username
+                )
+                SELECT s.image_path, d.detected_object_class, d.confidence_score,
+                       d.box_x1, d.box_y1, d.box_x2, d.box_y2, d.image_width, d.image_height
+                FROM sources s
+                LEFT JOIN raw.image_detections d
+                  ON d.message_id = s.message_id AND d.channel_username = s.channel_username
+                ORDER BY s.image_path, d.box_index, d.confidence_score DESC;
+            """, (list(image_paths), YOLO_MODEL_VERSION))
+            for image_path, detected_class, confidence, x1, y1, x2, y2, width, height in cur.fetchall():
+                analysis = cached.setdefault(image_path, {'detections': [], 'width': width, 'height': height, 'inference_ms': None})
+                if detected_class is not None:
+                    box = (x1, y1, x2, y2) if x1 is not None else None # Rows stored before boxes were kept
+                    analysis['detections'].append((detected_class, float(confidence), box))
+    except Exception as e:
+        logger.error(f"Error retrieving cached detections: {e}")
+        conn.rollback()
+    return cached
+
+def make_detection_id(channel_name, message_id, content_hash, model_version, box_index):
+    """
+    Deterministic detection ID: the same box of the same image for the same message and model
+    version always gets the same ID, so re-runs overwrite rows instead of duplicating them.
+    """
+    return f"{channel_name}_{message_id}_{content_hash[:16]}_{model_version}_{box_index}"
+
+def image_content_hash(image_path):
+    """Returns the SHA-256 of an image; store paths are named after it, so only legacy files are hashed."""
+    path = Path(image_path)
+    if IMAGE_STORE_PATH in path.parents:
+        return path.stem
+    return file_sha256(path)
+
+def scan_legacy_images(candidates):
+    """Adds the legacy Channel_MessageID[_Date].jpg files in IMAGE_DIR to `candidates`."""
+    with os.scandir(IMAGE_DIR) as it:
+        for image_file in it:
+            if not image_file.is_file() or Path(image_file.name).suffix.lower() not in ['.jpg', '.jpeg', '.png']:
+                continue
+            # Parse filename (e.g., Chemed_97.jpg or Chemed_97_20230101.jpg)
+            parts = Path(image_file.name).stem.split('_')
+            if len(parts) < 2 or not parts[1].isdigit():
+                logger.warning(f"Invalid filename format: {image_file.name}. Expected Channel_MessageID[_Date].jpg. Skipping.")
+                continue
+            channel_name, message_id = parts[0], int(parts[1])
+
+            # Map channel name to username
+            channel_username = CHANNEL_USERNAME_MAP.get(channel_name)
+            if not channel_username:
+                logger.warning(f"No username mapping for channel '{channel_name}' in {image_file.name}. Skipping.")
+                continue
+            # Photos tracked through the image store take precedence over legacy copies
+            candidates.setdefault((message_id, channel_username), (str(IMAGE_DIR / image_file.name), channel_name))
+
+def discover_pending_images(conn, full_scan=False, reprocess_outdated=False):
+    """
+    Groups unprocessed messages by image file: {image_path: [(channel_name, channel_username, message_id), ...]}.
+    Reads the manifest entries appended since the stored offset, plus the ledger's failed (or,
+    with reprocess_outdated, outdated) images. full_scan rereads the whole manifest and also
+    walks IMAGE_DIR for legacy files. Returns (pending, watermarks) to save once results commit.
+    """
+    watermarks = {} if full_scan else get_watermarks(conn)
+    candidates = {} # (message_id, channel_username) -> (image_path, channel_name)
+
+    entries, manifest_offset = read_manifest_since(IMAGE_MANIFEST_PATH, int(watermarks.get('manifest_offset', 0)))
+    for entry in entries:
+        channel_name, message_id = entry['channel'], entry['message_id']
+        channel_username = CHANNEL_USERNAME_MAP.get(channel_name)
+        if not channel_username:
+            logger.warning(f"No username mapping for channel '{channel_name}' in image manifest. Skipping.")
+            continue
+        if Path(entry['image_path']).exists():
+            candidates[(message_id, channel_username)] = (entry['image_path'], channel_name)
+    # The scraper only adds photos through the image store; legacy files predate it
+    if full_scan:
+        scan_legacy_images(candidates)
+
+    candidates = filter_unprocessed(conn, candidates)
+    usernames = {username: name for name, username in CHANNEL_USERNAME_MAP.items()}
+    for (message_id, channel_username), image_path in get_images_to_retry(conn, reprocess_outdated).items():
+        if channel_username in usernames and Path(image_path).exists():
+            candidates.setdefault((message_id, channel_username), (image_path, usernames[channel_username]))
+
+    pending = {}
+    for (message_id, channel_username), (image_path, channel_name) in candidates.items():
+        pending.setdefault(image_path, []).append((channel_name, channel_username, message_id))
+    return pending, {'manifest_offset': manifest_offset}
+
+def decode_image(image_path):
+    """Reads an image from disk into a BGR array (the format YOLO expects for in-memory images)."""
+    image = cv2.imread(str(image_path))
+    if image is None:
+        raise ValueError(f"Could not decode image {image_path}")
+    return image
+
+def iter_decoded_batches(image_paths, batch_size=YOLO_BATCH_SIZE, workers=YOLO_DECODE_WORKERS):
+    """
+    Yields batches of [(image_path, image_or_exception), ...]. Images are decoded by a thread
+    pool that stays up to two batches ahead of the consumer, so decoding overlaps with model
+    execution while memory stays bounded.
+    """
+    paths = iter(image_paths)
+    window = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def fill():
+            while len(window) < 2 * batch_size:
+                path = next(paths, None)
+                if path is None:
+                    return
+                window.append((path, executor.submit(decode_image, path)))
+
+        fill()
+        while window:
+            batch = []
+            while window and len(batch) < batch_size:
+                path, future = window.popleft()
+                try:
+                    batch.append((path, future.result()))
+                except Exception as e:
+                    batch.append((path, e))
+            fill() # Start decoding the next batches before the model runs on this one
+            yield batch
+
+def extract_detections(result, names):
+    """Converts one YOLO result into [(detected_class, confidence, (x1, y1, x2, y2)), ...] in pixels."""
+    detections = []
+    for box in result.boxes or []:
+        class_id = int(box.cls[0])
+        confidence = round(float(box.conf[0]), 4)
+        x1, y1, x2, y2 = (round(float(v), 1) for v in box.xyxy[0])
+        detections.append((names[class_id], confidence, (x1, y1, x2, y2)))
+    return detections
+
+def run_batched_inference(model, image_paths, batch_size=YOLO_BATCH_SIZE, workers=YOLO_DECODE_WORKERS):
+    """
+    Runs the model over image_paths in batches of batch_size with prefetched decoding.
+    Yields (image_path, analysis) per image, or (image_path, exception) if it failed, where
+    analysis is {'detections': [...], 'width': ..., 'height': ..., 'inference_ms': ...} and
+    inference_ms is the image's share of its batch's pre-processing, inference and NMS time.
+    """
+    for batch in iter_decoded_batches(image_paths, batch_size, workers):
+        decoded = [(path, image) for path, image in batch if not isinstance(image, Exception)]
+        for path, image in batch:
+            if isinstance(image, Exception):
+                yield path, image
+        if not decoded:
+            continue
+        try:
+            results = model([image for _, image in decoded], verbose=False)
+            for (path, _), result in zip(decoded, results):
+                height, width = result.orig_shape[:2]
+                yield path, {
+                    'detections': extract_detections(result, model.names),
+                    'width': int(width),
+                    'height': int(height),
+                    'inference_ms': round(sum((result.speed or {}).values()), 2),
+                }
+        except Exception as e:
+            for path, _ in decoded:
+                yield path, e
+
+def exported_model_path(backend, int8, cache_dir=YOLO_MODEL_CACHE_DIR):
+    """Returns where the exported model for a backend lives in the cache (named so YOLO() detects the format)."""
+    stem = Path(YOLO_MODEL_PATH).stem + ('_int8' if int8 else '')
+    if backend == 'onnx':
+        return Path(cache_dir) / f"{stem}.onnx"
+    if backend == 'openvino':
+        return Path(cache_dir) / f"{stem}_openvino_model"
+    raise ValueError(f"Unsupported YOLO_BACKEND: {backend}")
+
+def quantize_onnx(source_path, target_path):
+    """Dynamically quantizes an ONNX model's weights to INT8, keeping the class-name metadata YOLO reads."""
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(str(source_path), str(target_path), weight_type=QuantType.QUInt8)
+    source, quantized = onnx.load(str(source_path)), onnx.load(str(target_path))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, str(target_path))
+
+def export_model(backend, int8, cache_dir=YOLO_MODEL_CACHE_DIR):
+    """
+    Exports the .pt weights for the given backend into the cache, unless an export is already
+    cached, and returns its path. Exports use a dynamic batch dimension so batched inference works.
+    """
+    target = exported_model_path(backend, int8, cache_dir)
+    if target.exists():
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Exporting '{YOLO_MODEL_PATH}' for the {backend} backend{' (INT8)' if int8 else ''}...")
+    model = YOLO(YOLO_MODEL_PATH)
+    if backend == 'onnx':
+        exported = Path(model.export(format='onnx', dynamic=True))
+        if int8:
+            quantize_onnx(exported, target)
+            exported.unlink()
+        else:
+            shutil.move(str(exported), target)
+    else:
+        exported = Path(model.export(format='openvino', dynamic=True, int8=int8, data=YOLO_INT8_DATA if int8 else None))
+        shutil.move(str(exported), target)
+    logger.info(f"Cached exported model at {target}.")
+    return target
+
+def load_model(backend=YOLO_BACKEND, int8=YOLO_INT8):
+    """Loads the YOLO model for the configured backend, raising if it cannot be loaded."""
+    if backend == 'torch':
+        if int8:
+            logger.warning("YOLO_INT8 is only supported by the onnx and openvino backends; running unquantized.")
         model = YOLO(YOLO_MODEL_PATH)
         logger.info(f"YOLO model '{YOLO_MODEL_PATH}' loaded successfully.")
+        return model
+    model_path = export_model(backend, int8)
+    model = YOLO(str(model_path), task='detect')
+    logger.info(f"YOLO model '{model_path}' loaded successfully ({backend} backend).")
+    return model
+
+def insert_detections(conn, detection_results, ledger_rows=(), summary_rows=(), write_mode=YOLO_WRITE_MODE):
+    """
+    Writes detection rows into raw.image_detections, upserts per-image summaries into
+    raw.image_summaries, and records the images in raw.processed_images, in one transaction.
+    In 'replace' mode the earlier detections of every successfully processed message are
+    deleted first; in 'upsert' mode only the rows being rewritten are. Monthly partitions
+    for the new rows are created first, before the transaction touches raw.image_detections.
+    Returns the detection row count.
+    """
+    ledger_rows = list(ledger_rows)
+    with conn.cursor() as cur:
+        ensure_partitions(cur, 'raw.image_detections', [row[6] for row in detection_results],
+                          connect=get_db_connection)
+        if write_mode == 'replace':
+            replaced = [(row[0], row[1]) for row in ledger_rows if row[5] == 'done']
+            if replaced:
+                cur.execute("""
+                    DELETE FROM raw.image_detections d
+                    USING unnest(%s::BIGINT[], %s::TEXT[]) AS r(message_id, channel_username)
+                    WHERE d.message_id = r.message_id AND d.channel_username = r.channel_username;
+                """, ([key[0] for key in replaced], [key[1] for key in replaced]))
+        elif detection_results:
+            # Rows being rewritten are deleted rather than upserted: a rewritten row may land in
+            # another month's partition, where ON CONFLICT cannot see the old one
+            cur.execute("DELETE FROM raw.image_detections WHERE detection_id = ANY(%s);",
+                        ([row[0] for row in detection_results],))
+        insert_query = """
+            INSERT INTO raw.image_detections (
+                detection_id, message_id, channel_username, image_path,
+                detected_object_class, confidence_score, detection_timestamp,
+                box_index, box_x1, box_y1, box_x2, box_y2, image_width, image_height
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT DO NOTHING
+        """
+        execute_batch(cur, insert_query, detection_results, page_size=1000)
+        summary_query = """
+            INSERT INTO raw.image_summaries (
+                content_hash, model_version, image_path, image_width, image_height, detection_count,
+                class_counts, class_max_confidence, max_confidence, inference_ms, processed_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (content_hash, model_version) DO UPDATE SET
+                image_path = EXCLUDED.image_path,
+                image_width = EXCLUDED.image_width,
+                image_height = EXCLUDED.image_height,
+                detection_count = EXCLUDED.detection_count,
+                class_counts = EXCLUDED.class_counts,
+                class_max_confidence = EXCLUDED.class_max_confidence,
+                max_confidence = EXCLUDED.max_confidence,
+                inference_ms = EXCLUDED.inference_ms,
+                processed_at = EXCLUDED.processed_at
+        """
+        execute_batch(cur, summary_query, list(summary_rows), page_size=1000)
+        ledger_query = """
+            INSERT INTO raw.processed_images (
+                message_id, channel_username, image_path, content_hash,
+                model_version, status, detection_count, error, processed_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (message_id, channel_username) DO UPDATE SET
+                image_path = EXCLUDED.image_path,
+                content_hash = EXCLUDED.content_hash,
+                model_version = EXCLUDED.model_version,
+                status = EXCLUDED.status,
+                detection_count = EXCLUDED.detection_count,
+                error = EXCLUDED.error,
+                processed_at = EXCLUDED.processed_at
+        """
+        execute_batch(cur, ledger_query, ledger_rows, page_size=1000)
+    conn.commit()
+    return len(detection_results)
+
+def summarize_image(image_path, content_hash, analysis):
+    """Builds the raw.image_summaries row for one inferred image."""
+    detections = analysis['detections']
+    class_counts = Counter(detected_class for detected_class, _, _ in detections)
+    class_max_confidence = {}
+    for detected_class, confidence, _ in detections:
+        class_max_confidence[detected_class] = max(confidence, class_max_confidence.get(detected_class, 0.0))
+    return (
+        content_hash,
+        YOLO_MODEL_VERSION,
+        image_path,
+        analysis['width'],
+        analysis['height'],
+        len(detections),
+        json.dumps(class_counts),
+        json.dumps(class_max_confidence),
+        max(class_max_confidence.values(), default=None),
+        analysis['inference_ms'],
+    )
+
+class DetectionCheckpointer:
+    """
+    Buffers detection, summary and ledger rows and commits them every `every` images or `seconds`
+    seconds. Each commit is a checkpoint: a crash loses at most one chunk, images recorded in
+    the ledger are skipped on restart, and memory holds at most one chunk of rows.
+    """
+
+    def __init__(self, conn, every=YOLO_COMMIT_EVERY, seconds=YOLO_COMMIT_SECONDS):
+        self.conn = conn
+        self.every = every
+        self.seconds = seconds
+        self.rows = []
+        self.ledger_rows = []
+        self.summary_rows = []
+        self.images = 0
+        self.committed_detections = 0
+        self._last_commit = time.monotonic()
+
+    def add(self, rows, ledger_rows, summary_row=None):
+        """Adds the rows for one processed image and commits if a checkpoint is due."""
+        self.rows.extend(rows)
+        self.ledger_rows.extend(ledger_rows)
+        if summary_row:
+            self.summary_rows.append(summary_row)
+        self.images += 1
+        if self.images >= self.every or time.monotonic() - self._last_commit >= self.seconds:
+            self.flush()
+
+    def flush(self):
+        """Commits the buffered rows."""
+        if self.ledger_rows:
+            self.committed_detections += insert_detections(self.conn, self.rows, self.ledger_rows, self.summary_rows)
+            logger.info(f"Checkpoint: committed {len(self.rows)} detections for {self.images} images.")
+        self.rows = []
+        self.ledger_rows = []
+        self.summary_rows = []
+        self.images = 0
+        self._last_commit = time.monotonic()
+
+def process_images(model, conn, pending_images, cached_detections):
+    """
+    Runs detection over pending_images ({image_path: references}), reusing cached detections
+    where available, and streams one row per detection per referencing message to the
+    database in checkpointed chunks, recording every image (including failures) in the ledger.
+    Returns a summary dict with image, detection and error counts; 'complete' is False if
+    results could not be committed.
+    """
+    summary = {'images': 0, 'detections': 0, 'errors': [], 'complete': True}
+    checkpointer = DetectionCheckpointer(conn)
+
+    # Run the model in batches over the images without reusable detections
+    to_infer = [image_path for image_path in pending_images if image_path not in cached_detections]
+    inferred = run_batched_inference(model, to_infer) if to_infer else iter(())
+    cached = ((image_path, cached_detections[image_path]) for image_path in pending_images if image_path in cached_detections)
+
+    try:
+        for image_path, analysis in chain(cached, inferred):
+            references = pending_images[image_path]
+            if isinstance(analysis, Exception):
+                logger.error(f"Error processing image {image_path}: {analysis}")
+                summary['errors'].append((image_path, str(analysis)))
+                checkpointer.add([], [
+                    (int(message_id), channel_username, image_path, None, YOLO_MODEL_VERSION, 'failed', 0, str(analysis))
+                    for _, channel_username, message_id in references
+                ])
+                continue
+            detections = analysis['detections']
+            if not detections:
+                logger.info(f"No objects detected in {image_path}.")
+
+            content_hash = image_content_hash(image_path)
+            rows = []
+            ledger_rows = []
+            for channel_name, channel_username, message_id in references:
+                for box_index, (detected_class, confidence, box) in enumerate(detections):
+                    rows.append((
+                        make_detection_id(channel_name, message_id, content_hash, YOLO_MODEL_VERSION, box_index),
+                        int(message_id),
+                        channel_username,
+                        image_path,
+                        detected_class,
+                        confidence,
+                        datetime.now(),
+                        box_index,
+                        *(box or (None, None, None, None)),
+                        analysis['width'],
+                        analysis['height']
+                    ))
+                ledger_rows.append((
+                    int(message_id), channel_username, image_path, content_hash,
+                    YOLO_MODEL_VERSION, 'done', len(detections), None
+                ))
+            # Summaries are written when an image is inferred; reused detections already have one
+            summary_row = None
+            if analysis['inference_ms'] is not None:
+                summary_row = summarize_image(image_path, content_hash, analysis)
+            checkpointer.add(rows, ledger_rows, summary_row)
+            summary['images'] += 1
+            logger.info(f"Processed {image_path} with {len(detections)} detections for {len(references)} messages.")
+        checkpointer.flush()
     except Exception as e:
-        logger.error(f"Failed to load YOLO model: {e}")
-        return
+        # Earlier checkpoints stay committed; only the current chunk is lost and will be redone on restart
+        logger.error(f"Error committing detection results: {e}")
+        conn.rollback()
+        summary['errors'].append(('<commit>', str(e)))
+        summary['complete'] = False
+
+    summary['detections'] = checkpointer.committed_detections
+    logger.info(f"Inserted {summary['detections']} detection results into raw.image_detections.")
+    return summary
+
+# --- Sharded execution: each worker process holds one model and one connection ---
+_worker_model = None
+_worker_conn = None
+
+def _init_worker(workers):
+    """Loads the model and opens a connection once per worker process."""
+    global _worker_model, _worker_conn
+    try:
+        import torch
+        # Split the CPU cores between workers instead of every process using all of them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except ImportError:
+        pass
+    _worker_model = load_model()
+    _worker_conn = get_db_connection()
+    # Close it when the worker exits; forked workers leave through os._exit, skipping atexit
+    mp_util.Finalize(None, _worker_conn.close, exitpriority=10)
+
+def _process_shard(shard, cached_detections):
+    return process_images(_worker_model, _worker_conn, shard, cached_detections)
+
+def make_shards(pending_images, shard_size=YOLO_SHARD_SIZE):
+    """Splits {image_path: references} into dicts of at most shard_size images."""
+    items = list(pending_images.items())
+    return [dict(items[i:i + shard_size]) for i in range(0, len(items), shard_size)]
+
+def process_images_sharded(pending_images, cached_detections, workers=YOLO_WORKERS, shard_size=YOLO_SHARD_SIZE):
+    """
+    Partitions the pending images into shards and processes them across `workers` processes.
+    The coordinator merges per-shard summaries into overall progress and error reporting.
+    """
+    shards = make_shards(pending_images, shard_size)
+    if YOLO_BACKEND != 'torch':
+        export_model(YOLO_BACKEND, YOLO_INT8) # Export once here rather than racing in every worker
+    total = {'images': 0, 'detections': 0, 'errors': [], 'complete': True}
+    logger.info(f"Processing {len(pending_images)} images in {len(shards)} shards across {workers} worker processes.")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workers,)) as executor:
+        futures = {
+            executor.submit(_process_shard, shard, {p: cached_detections[p] for p in shard if p in cached_detections}): shard
+            for shard in shards
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            shard = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e: # Worker crashed or could not load the model / connect
+                summary = {'images': 0, 'detections': 0, 'errors': [(path, str(e)) for path in shard], 'complete': False}
+            total['images'] += summary['images']
+            total['detections'] += summary['detections']
+            total['errors'].extend(summary['errors'])
+            total['complete'] = total['complete'] and summary['complete']
+            logger.info(f"Shard {done}/{len(shards)} done: {total['images']}/{len(pending_images)} images, "
+                        f"{total['detections']} detections, {len(total['errors'])} errors so far.")
+    return total
+
+def main(full_scan=False, reprocess_outdated=False):
+    """Run YOLO object detection and store results in the database."""
+    logger.info("Starting YOLO object detection process...")
 
     conn = None
     try:
         conn = get_db_connection()
         create_detection_table(conn)
-        processed_images = get_processed_images(conn)
+        create_ledger_tables(conn)
 
-        images_to_process = []
         if not IMAGE_DIR.exists():
             logger.error(f"Image directory not found: {IMAGE_DIR}. Please ensure images are scraped.")
             return
 
-        for image_file in IMAGE_DIR.iterdir():
-            if image_file.is_file() and image_file.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-                relative_image_path = str(image_file.relative_to(Path('.')))
-                if relative_image_path not in processed_images:
-                    images_to_process.append(image_file)
-        
-        logger.info(f"Found {len(images_to_process)} new images to process.")
+        # Each distinct image is inferred once, however many messages repost it
+        pending_images, watermarks = discover_pending_images(conn, full_scan, reprocess_outdated)
+        logger.info(f"Found {len(pending_images)} new images to process for "
+                    f"{sum(len(refs) for refs in pending_images.values())} messages.")
 
-        if not images_to_process:
+        if not pending_images:
+            save_watermarks(conn, watermarks)
             logger.info("No new images to process. Exiting.")
             return
 
-        detection_results = []
-        for image_path_obj in images_to_process:
-            try:
-                # Parse filename (e.g., Chemed_97.jpg or Chemed_97_20230101.jpg)
-                parts = image_path_obj.stem.split('_')
-                if len(parts) >= 2:
-                    channel_name = parts[0]
-                    message_id = parts[1]
-                else:
-                    logger.warning(f"Invalid filename format: {image_path_obj.name}. Expected Channel_MessageID[_Date].jpg. Skipping.")
-                    continue
-
-                # Map channel name to username
-                channel_username = CHANNEL_USERNAME_MAP.get(channel_name)
-                if not channel_username:
-                    logger.warning(f"No username mapping for channel '{channel_name}' in {image_path_obj.name}. Skipping.")
-                    continue
-
-                # Perform detection
-                results = model(str(image_path_obj))
-                
-                # Extract results
-                for r in results:
-                    if not r.boxes:
-                        logger.info(f"No objects detected in {image_path_obj.name}.")
-                        continue
-                    for box in r.boxes:
-                        class_id = int(box.cls[0])
-                        confidence = round(float(box.conf[0]), 4)
-                        detected_class = model.names[class_id]
-                        detection_id = f"{image_path_obj.stem}_{detected_class}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-                        
-                        detection_results.append((
-                            detection_id,
-                            int(message_id),
-                            channel_username,
-                            str(image_path_obj.relative_to(Path('.'))),
-                            detected_class,
-                            confidence,
-                            datetime.now()
-                        ))
-                logger.info(f"Processed {image_path_obj.name} with {len(r.boxes)} detections.")
-            except Exception as e:
-                logger.error(f"Error processing image {image_path_obj.name}: {e}")
-                continue
+        cached_detections = get_cached_detections(conn, pending_images.keys())
+        logger.info(f"Reusing earlier detections for {len(cached_detections)} images.")
+        # End the discovery reads' transaction: its locks would block the partition creation
+        # of the workers (and of this connection's own writes) until the run finishes
+        conn.commit()
 
-        if detection_results:
+        workers = min(YOLO_WORKERS, len(make_shards(pending_images)))
+        if workers > 1:
+            summary = process_images_sharded(pending_images, cached_detections, workers)
+        else:
+            # Load YOLO model
             try:
-                with conn.cursor() as cur:
-                    insert_query = """
-                        INSERT INTO raw.image_detections (
-                            detection_id, message_id, channel_username, image_path,
-                            detected_object_class, confidence_score, detection_timestamp
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (detection_id) DO NOTHING
-                    """
-                    execute_batch(cur, insert_query, detection_results, page_size=1000)
-                    inserted_count = cur.rowcount
-                    conn.commit()
-                    logger.info(f"Inserted {inserted_count} detection results into raw.image_detections.")
+                model = load_model()
             except Exception as e:
-                logger.error(f"Error inserting detection results: {e}")
-                conn.rollback()
+                logger.error(f"Failed to load YOLO model: {e}")
+                return
+            summary = process_images(model, conn, pending_images, cached_detections)
+
+        for image_path, error in summary['errors']:
+            logger.error(f"Failed: {image_path}: {error}")
+        if summary['complete']:
+            # Every discovered image is now in the ledger; later runs only scan newer sources
+            save_watermarks(conn, watermarks)
         else:
-            logger.info("No detection results to insert.")
+            logger.warning("Some results were not committed; discovery watermarks were not advanced.")
+        logger.info(f"YOLO run complete: {summary['images']} images processed, "
+                    f"{summary['detections']} detections stored, {len(summary['errors'])} errors.")
 
     except Exception as e:
         logger.error(f"Main YOLO process error: {e}")
@@ -196,4 +761,10 @@ def main():
             logger.info("Database connection closed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run YOLO enrichment on newly scraped images.")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Ignore the manifest watermark and also walk data/images for legacy files, checking every image against the ledger.")
+    parser.add_argument("--reprocess-outdated", action="store_true",
+                        help="Re-run images processed with a model version other than YOLO_MODEL_VERSION.")
+    args = parser.parse_args()
+    main(full_scan=args.full_scan, reprocess_outdated=args.reprocess_outdated)
@@ -0,0 +1,220 @@
+"""
+Tests for the Redis response cache in api/cache.py and the single-flight fill in api/main.py.
+
+FakeRedis is a small threaded socket server speaking RESP2 with the handful of commands the
+cache sends (GET, SET with EX/PX/NX, DEL, EXISTS, SELECT and the fill lock's EVAL script),
+so the client, the cross-process fill lock and the request coalescing run over a real socket
+without a Redis server.
+"""
+import asyncio
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from api.cache import RedisCacheBackend, RedisClient, RedisError
+
+class FakeRedis(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """In-memory RESP2 server. `commands` records every command name it received."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.store = {} # key -> (value, expires_at or None)
+        self.commands = []
+        self.lock = threading.Lock()
+        self.connections = []
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/1"
+
+    def drop_connections(self):
+        """Closes every client connection, as a restarting server would."""
+        for handler in self.connections:
+            handler.connection.close()
+
+    def run(self, args):
+        command = args[0].upper()
+        self.commands.append(command.decode())
+        now = time.monotonic()
+        for key, (_, expires_at) in list(self.store.items()):
+            if expires_at is not None and expires_at <= now:
+                del self.store[key]
+        if command == b"SELECT":
+            return b"+OK\r\n"
+        if command == b"GET":
+            return bulk(self.store.get(args[1], (None,))[0])
+        if command == b"SET":
+            options = [arg.upper() for arg in args[3:]]
+            if b"NX" in options and args[1] in self.store:
+                return bulk(None)
+            expires_at = None
+            if b"EX" in options:
+                expires_at = now + int(args[4 + options.index(b"EX")])
+            if b"PX" in options:
+                expires_at = now + int(args[4 + options.index(b"PX")]) / 1000
+            self.store[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            return b":%d\r\n" % sum(self.store.pop(key, None) is not None for key in args[1:])
+        if command == b"EXISTS":
+            return b":%d\r\n" % sum(key in self.store for key in args[1:])
+        if command == b"EVAL" and args[1].decode() == RedisCacheBackend.UNLOCK_SCRIPT:
+            key, token = args[3], args[4]
+            if self.store.get(key, (None,))[0] == token:
+                del self.store[key]
+                return b":1\r\n"
+            return b":0\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections.append(self)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            with self.server.lock:
+                reply = self.server.run(args)
+            self.wfile.write(reply)
+
+def bulk(value):
+    return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+@pytest.fixture
+def redis_server():
+    server = FakeRedis()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def make_backend(server, **kwargs):
+    return RedisCacheBackend(client=RedisClient(server.url), **kwargs)
+
+def test_client_parses_replies(redis_server):
+    client = RedisClient(redis_server.url)
+    assert client.execute("SET", "k", "v\r\nwith a break") == "OK"
+    assert client.execute("GET", "k") == b"v\r\nwith a break"
+    assert client.execute("GET", "missing") is None
+    assert client.execute("DEL", "k", "missing") == 1
+    with pytest.raises(RedisError):
+        client.execute("FLUSHALL")
+    assert redis_server.commands[0] == "SELECT" # The /1 in the URL
+
+def test_client_reconnects_once_after_the_connection_drops(redis_server):
+    client = RedisClient(redis_server.url)
+    client.execute("SET", "k", "v")
+    redis_server.drop_connections()
+    assert client.execute("GET", "k") == b"v"
+
+def test_entries_are_shared_between_workers(redis_server):
+    first, second = make_backend(redis_server), make_backend(redis_server)
+    stored = first.set("/api/channels?", [{"channel": "@tikvahpharma"}], {"X-Next-Cursor": "abc"})
+    entry = second.get("/api/channels?")
+    assert entry.value == [{"channel": "@tikvahpharma"}]
+    assert entry.headers == {"X-Next-Cursor": "abc"}
+    assert (entry.etag, entry.last_modified) == (stored.etag, stored.last_modified)
+    assert second.metrics()["hits"] == 1
+
+def test_fill_lock_is_released_only_by_its_owner(redis_server):
+    owner, other = make_backend(redis_server), make_backend(redis_server)
+    assert owner.try_lock("key")
+    assert not other.try_lock("key")
+    other.unlock("key")
+    assert other.is_locked("key")
+    owner.unlock("key")
+    assert not other.is_locked("key")
+    assert other.try_lock("key")
+    assert "GET" not in redis_server.commands # Released with the compare-and-delete script
+
+def test_expired_fill_lock_taken_over_is_not_released_by_the_first_owner(redis_server):
+    owner, other = make_backend(redis_server, lock_timeout=0.05), make_backend(redis_server)
+    assert owner.try_lock("key")
+    time.sleep(0.1)
+    assert other.try_lock("key")
+    owner.unlock("key")
+    assert other.is_locked("key")
+
+def test_unreachable_server_degrades_to_misses(redis_server):
+    backend = make_backend(redis_server)
+    redis_server.shutdown()
+    redis_server.server_close()
+    assert backend.get("key") is None
+    assert backend.try_lock("key") # Nothing to coordinate with; compute locally
+    assert not backend.is_locked("key")
+    assert backend.metrics()["errors"] == 1 # Later calls skip Redis until RETRY_AFTER_SECONDS
+
+@pytest.fixture
+def api_main(redis_server, monkeypatch):
+    pytest.importorskip("psycopg2")
+    from api import main
+    monkeypatch.setattr(main, "response_cache", make_backend(redis_server))
+    monkeypatch.setattr(main, "API_CACHE_FILL_TIMEOUT", 5)
+    return main
+
+def test_concurrent_misses_run_one_load(api_main):
+    from fastapi import Response
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"product": "paracetamol", "mentions": 3}]
+
+    async def run():
+        return await asyncio.gather(*[api_main.load_once("key", Response(), load) for _ in range(20)])
+
+    entries = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(entry.value == [{"product": "paracetamol", "mentions": 3}] for entry in entries)
+    assert not api_main.response_cache.is_locked("key")
+
+def test_waiter_uses_another_workers_fill(api_main, redis_server):
+    from fastapi import Response
+    other_worker = make_backend(redis_server)
+    assert other_worker.try_lock("key")
+
+    async def load():
+        raise AssertionError("The other worker's entry should be used")
+
+    async def run():
+        waiter = asyncio.ensure_future(api_main.load_once("key", Response(), load))
+        await asyncio.sleep(0.2)
+        other_worker.set("key", ["filled elsewhere"])
+        other_worker.unlock("key")
+        return await waiter
+
+    assert asyncio.run(run()).value == ["filled elsewhere"]
+
+def test_waiter_stops_waiting_when_the_other_fill_fails(api_main, redis_server):
+    from fastapi import Response
+    other_worker = make_backend(redis_server)
+    assert other_worker.try_lock("key")
+
+    async def load():
+        return ["computed here"]
+
+    async def run():
+        waiter = asyncio.ensure_future(api_main.load_once("key", Response(), load))
+        await asyncio.sleep(0.2)
+        other_worker.unlock("key") # Its load raised, so it stored nothing
+        return await waiter
+
+    start = time.monotonic()
+    assert asyncio.run(run()).value == ["computed here"]
+    assert time.monotonic() - start < 1 # Not the full API_CACHE_FILL_TIMEOUT
@@ -0,0 +1,131 @@
+"""
+Tests for the API's connection pool in api/database.py.
+
+FakeConnection stands in for a psycopg2 connection and get_db_connection is patched to hand
+them out, so the pool's reuse, health checks and limits run without a database.
+"""
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from api import database
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.pings = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.conn.pings += 1
+        if self.conn.broken:
+            raise database.psycopg2.OperationalError("server closed the connection")
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Every connection the pool opened, in order."""
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(database, "get_db_connection", connect)
+    return connections
+
+def check_out_concurrently(pool, n):
+    """Checks out n connections from n threads at once and returns them."""
+    barrier = threading.Barrier(n)
+    conns = []
+    lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        conn = pool.getconn()
+        with lock:
+            conns.append(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return conns
+
+def test_concurrently_returned_connections_are_all_reused(opened):
+    pool = database.ConnectionPool(minconn=2, maxconn=10, health_check_idle=30)
+    first = check_out_concurrently(pool, 8)
+    assert len(opened) == 8
+    for conn in first:
+        pool.putconn(conn)
+    assert pool.metrics()["idle"] == 8
+    assert not any(conn.closed for conn in opened)
+
+    second = check_out_concurrently(pool, 8)
+    assert len(opened) == 8 # Nothing new opened
+    assert {id(conn) for conn in second} == {id(conn) for conn in first}
+    assert pool.metrics()["in_use"] == 8
+
+def test_idle_connections_are_pinged_and_broken_ones_replaced(opened):
+    pool = database.ConnectionPool(minconn=1, maxconn=2, health_check_idle=0)
+    opened[0].broken = True
+    conn = pool.getconn()
+    assert conn is opened[1] # The broken idle connection was discarded, a new one opened
+    assert opened[0].closed
+    assert pool.metrics()["discarded"] == 1
+
+def test_recently_returned_connections_skip_the_ping(opened):
+    pool = database.ConnectionPool(minconn=0, maxconn=2, health_check_idle=30)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.pings == 0
+
+def test_connections_returned_as_broken_are_closed(opened):
+    pool = database.ConnectionPool(minconn=0, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn, close=True)
+    assert conn.closed
+    assert pool.metrics()["idle"] == 0
+    assert pool.getconn() is not conn
+
+def test_checkout_times_out_when_every_connection_is_in_use(opened):
+    pool = database.ConnectionPool(minconn=0, maxconn=1, timeout=0.05)
+    pool.getconn()
+    with pytest.raises(database.PoolTimeoutError):
+        pool.getconn()
+    assert pool.metrics()["timeouts"] == 1
+
+def test_closeall_closes_idle_and_later_returned_connections(opened):
+    pool = database.ConnectionPool(minconn=2, maxconn=3)
+    conn = pool.getconn()
+    pool.closeall()
+    assert opened[0].closed and not conn.closed
+    pool.putconn(conn)
+    assert conn.closed
@@ -0,0 +1,163 @@
+"""
+Tests for the resumable, FloodWait-aware scraper in scripts/telegram_scraper.py.
+
+A FakeClient stands in for Telethon's TelegramClient: it serves a channel's history with
+the same paging semantics (descending by default, offset_id / min_id bounds, reverse) and
+raises FloodWaitError part-way through a page, so resuming can be checked without Telegram.
+Every test runs in a temporary working directory, where the scraper's relative data and
+state paths then point.
+"""
+import asyncio
+import importlib
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+telethon_errors = pytest.importorskip("telethon.errors")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+CHANNEL = '@tikvahpharma'
+CHANNEL_NAME = 'TikvahPharma' # A channel without image downloads
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+        self.date = datetime(2025, 1, 1, 12, 0)
+        self.text = f"message {message_id}"
+        self.views = 10
+        self.forwards = 1
+        self.photo = None
+        self.media = None
+
+class FakeClient:
+    """
+    Minimal TelegramClient stand-in. `flood_at` holds message counts (across all calls) at
+    which iter_messages raises FloodWaitError once, before yielding that message;
+    `fail_at` raises a non-retryable error the same way.
+    """
+
+    def __init__(self, message_ids, flood_at=(), fail_at=()):
+        self.history = sorted(message_ids)
+        self.flood_at = set(flood_at)
+        self.fail_at = set(fail_at)
+        self.yielded = 0
+
+    def add(self, message_ids):
+        self.history = sorted(set(self.history) | set(message_ids))
+
+    async def get_entity(self, username):
+        return username
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, reverse=False):
+        ids = [i for i in self.history if i > min_id and (not offset_id or reverse or i < offset_id)]
+        if not reverse:
+            ids.reverse()
+        for message_id in ids[:limit]:
+            if self.yielded + 1 in self.flood_at:
+                self.flood_at.discard(self.yielded + 1)
+                raise telethon_errors.FloodWaitError(request=None, capture=0)
+            if self.yielded + 1 in self.fail_at:
+                self.fail_at.discard(self.yielded + 1)
+                raise RuntimeError("connection lost")
+            self.yielded += 1
+            yield FakeMessage(message_id)
+
+    async def download_media(self, media, file=None):
+        raise AssertionError("No photos in these tests")
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('telegram_scraper')
+    monkeypatch.setattr(module, 'TARGET_CHANNELS', {CHANNEL: CHANNEL_NAME})
+    return module
+
+def collect_ids(scraper, client, **kwargs):
+    async def run():
+        stats = scraper.ChannelStats(CHANNEL_NAME)
+        limiter = scraper.RateLimiter(rate=1e6)
+        ids = [m.id async for m in scraper.iter_messages_resumable(client, CHANNEL, limiter, stats, CHANNEL_NAME, **kwargs)]
+        return ids, stats
+    return asyncio.run(run())
+
+def run_scraper(scraper, client, **kwargs):
+    asyncio.run(scraper.scrape_all_channels(client, '2025-01-01', limiter=scraper.RateLimiter(rate=1e6), **kwargs))
+
+def lake_ids():
+    """Message ids across every completed lake file, duplicates included."""
+    from data_lake import iter_messages
+    return [msg['message_id'] for path in sorted(Path('data/raw/telegram_messages').rglob('*.jsonl'))
+            for msg in iter_messages(path)]
+
+def test_flood_wait_mid_page_skips_and_duplicates_nothing(scraper):
+    client = FakeClient(range(1, 251), flood_at={130, 205})
+    ids, stats = collect_ids(scraper, client)
+    assert ids == list(range(250, 0, -1))
+    assert stats.flood_waits == 2
+
+def test_flood_wait_resumes_ascending_iteration_after_min_id(scraper):
+    client = FakeClient(range(1, 251), flood_at={57})
+    ids, _ = collect_ids(scraper, client, min_id=100, reverse=True)
+    assert ids == list(range(101, 251))
+
+def test_flood_wait_keeps_the_requested_limit(scraper):
+    client = FakeClient(range(1, 251), flood_at={120})
+    ids, _ = collect_ids(scraper, client, limit=150)
+    assert ids == list(range(250, 100, -1))
+
+def test_watermark_advances_only_after_lake_file_is_written(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, 'SCRAPE_INITIAL_LIMIT', 50)
+    real_save_state = scraper.save_state
+
+    def checking_save_state(state, path=scraper.SCRAPER_STATE_PATH):
+        # By the time the watermark is persisted, its messages are in a closed lake file
+        assert not list(Path('data').rglob('*.part'))
+        assert state[CHANNEL]['last_message_id'] in lake_ids()
+        real_save_state(state, path)
+
+    monkeypatch.setattr(scraper, 'save_state', checking_save_state)
+
+    client = FakeClient(range(1, 201), flood_at={30})
+    run_scraper(scraper, client)
+    assert sorted(lake_ids()) == list(range(151, 201))
+    assert scraper.load_state()[CHANNEL]['last_message_id'] == 200
+
+    # New messages arrive; the next run fetches exactly those, across another FloodWait
+    client.add(range(201, 351))
+    client.flood_at = {client.yielded + 70}
+    run_scraper(scraper, client)
+    assert sorted(lake_ids()) == list(range(151, 351))
+    assert scraper.load_state()[CHANNEL]['last_message_id'] == 350
+
+def test_failed_scrape_keeps_the_previous_watermark(scraper, monkeypatch):
+    monkeypatch.setattr(scraper, 'SCRAPE_INITIAL_LIMIT', 50)
+    client = FakeClient(range(1, 201))
+    run_scraper(scraper, client)
+
+    client.add(range(201, 301))
+    client.fail_at = {client.yielded + 20}
+    run_scraper(scraper, client)
+    assert scraper.load_state()[CHANNEL]['last_message_id'] == 200
+    assert sorted(lake_ids()) == list(range(151, 201)) # The partial file was discarded
+
+    # The next run picks up everything after the old watermark
+    run_scraper(scraper, client)
+    assert sorted(lake_ids()) == list(range(151, 301))
+
+def test_backfill_resumes_from_the_saved_position(scraper):
+    client = FakeClient(range(1, 251), flood_at={40})
+    run_scraper(scraper, client, backfill=True, chunk_size=100, max_chunks=1)
+    state = scraper.load_state()[CHANNEL]
+    assert state['oldest_message_id'] == 151
+    assert not state.get('backfill_complete')
+    assert sorted(lake_ids()) == list(range(151, 251))
+
+    client.flood_at = {client.yielded + 130}
+    run_scraper(scraper, client, backfill=True, chunk_size=100)
+    state = scraper.load_state()[CHANNEL]
+    assert state['backfill_complete']
+    assert sorted(lake_ids()) == list(range(1, 251))